@@ -0,0 +1,170 @@
+# admission.py
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from request_context import bounded_timeout
+
+# Model calls in flight at once across the whole process
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# Calls allowed to wait for a slot, overall and per user; beyond that, 429
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_MAX_QUEUED_PER_USER = int(os.getenv("LLM_MAX_QUEUED_PER_USER", "2"))
+# Longest wait (seconds) for a slot before giving up with 429
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "20"))
+# Embedding API calls in flight at once (cache hits don't count), and their wait limit
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "8"))
+EMBED_QUEUE_TIMEOUT = float(os.getenv("EMBED_QUEUE_TIMEOUT", "5"))
+MAX_RETRY_AFTER = 30
+
+class Overloaded(Exception):
+    """No capacity for this call; the client should retry after retry_after seconds."""
+
+    def __init__(self, retry_after: int, reason: str = 'queue_full'):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+class AdmissionController:
+    """
+    Concurrency limit for model calls with a bounded, per-user fair wait
+    queue. Waiting users are served round-robin, so one user's burst cannot
+    starve the others; calls that would overflow the queue (or a user's share
+    of it) are rejected at once with Overloaded. Lives on the event loop.
+    """
+
+    def __init__(self, max_concurrent: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_MAX_QUEUE,
+                 max_queued_per_user: int = LLM_MAX_QUEUED_PER_USER, queue_timeout: float = LLM_QUEUE_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queued_per_user = max_queued_per_user
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.queued = 0
+        self._waiters = OrderedDict()  # user_id -> deque of futures, served round-robin
+        self._stats = Counter()
+        self._wait_times = deque(maxlen=500)
+        self._service_times = deque(maxlen=200)
+
+    def try_acquire(self) -> bool:
+        """Take a free slot without queueing (never jumps ahead of waiters)."""
+        if self.active < self.max_concurrent and not self.queued:
+            self.active += 1
+            return True
+        return False
+
+    def retry_after(self) -> int:
+        service = sum(self._service_times) / len(self._service_times) if self._service_times else 2.0
+        estimate = service * (self.queued + 1) / max(self.max_concurrent, 1)
+        return min(MAX_RETRY_AFTER, max(1, math.ceil(estimate)))
+
+    def _reject(self, reason: str):
+        self._stats['rejected_' + reason] += 1
+        raise Overloaded(self.retry_after(), reason)
+
+    async def acquire(self, user_id: str = None):
+        started = time.monotonic()
+        if self.try_acquire():
+            self._stats['admitted'] += 1
+            self._wait_times.append(0.0)
+            return
+        if self.queued >= self.max_queue:
+            self._reject('queue_full')
+        user_queue = self._waiters.get(user_id)
+        if user_queue is not None and len(user_queue) >= self.max_queued_per_user:
+            self._reject('user_queue_full')
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(user_id, deque()).append(future)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(future, bounded_timeout(self.queue_timeout))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                self.release()  # the slot arrived just as we gave up
+            else:
+                self._remove_waiter(user_id, future)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._reject('timeout')
+        self._stats['admitted'] += 1
+        self._stats['waited'] += 1
+        self._wait_times.append(time.monotonic() - started)
+
+    def _remove_waiter(self, user_id: str, future):
+        user_queue = self._waiters.get(user_id)
+        if user_queue is not None and future in user_queue:
+            user_queue.remove(future)
+            self.queued -= 1
+            if not user_queue:
+                del self._waiters[user_id]
+
+    def release(self):
+        """Hand the slot to the next waiting user in turn, or free it."""
+        while self._waiters:
+            user_id, user_queue = next(iter(self._waiters.items()))
+            future = user_queue.popleft()
+            self.queued -= 1
+            if user_queue:
+                self._waiters.move_to_end(user_id)
+            else:
+                del self._waiters[user_id]
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, user_id: str = None):
+        await self.acquire(user_id)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._service_times.append(time.monotonic() - started)
+            self.release()
+
+    def stats(self) -> dict:
+        waits = sorted(self._wait_times)
+        return {
+            **self._stats,
+            'active': self.active,
+            'queued': self.queued,
+            'waiting_users': len(self._waiters),
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'wait_p50': round(waits[len(waits) // 2], 3) if waits else 0.0,
+            'wait_p95': round(waits[int(0.95 * (len(waits) - 1))], 3) if waits else 0.0,
+        }
+
+llm_admission = AdmissionController()
+
+# Embedding calls run in worker threads, so they get a plain semaphore
+_embed_slots = threading.BoundedSemaphore(EMBED_MAX_CONCURRENCY)
+_embed_stats = Counter()
+_embed_lock = threading.Lock()
+
+@contextmanager
+def embedding_slot():
+    """Limit concurrent embedding API calls; raises Overloaded after EMBED_QUEUE_TIMEOUT."""
+    if not _embed_slots.acquire(timeout=EMBED_QUEUE_TIMEOUT):
+        with _embed_lock:
+            _embed_stats['rejected_timeout'] += 1
+        raise Overloaded(1, 'embedding_timeout')
+    with _embed_lock:
+        _embed_stats['active'] += 1
+        _embed_stats['admitted'] += 1
+    try:
+        yield
+    finally:
+        with _embed_lock:
+            _embed_stats['active'] -= 1
+        _embed_slots.release()
+
+def get_admission_stats() -> dict:
+    with _embed_lock:
+        embeddings = {**_embed_stats, 'max_concurrent': EMBED_MAX_CONCURRENCY}
+    return {'llm': llm_admission.stats(), 'embeddings': embeddings}
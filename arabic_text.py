@@ -0,0 +1,56 @@
+# arabic_text.py
+import re
+import unicodedata
+
+# Harakat, tanween, shadda, sukun, superscript alef and Quranic marks
+_DIACRITICS = re.compile(r"[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED]")
+_TATWEEL = "\u0640"
+
+_CHAR_MAP = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ى": "ي", "ی": "ي",
+    "ة": "ه",
+    "ؤ": "و", "ئ": "ي",
+    # Arabic-Indic and Persian digits -> ASCII, so "٢٠٢٤" matches "2024"
+    **{chr(0x0660 + i): str(i) for i in range(10)},
+    **{chr(0x06F0 + i): str(i) for i in range(10)},
+})
+
+_TOKEN = re.compile(r"\w+")
+
+# Prefixes stripped by the light stemmer (longest first)
+_PREFIXES = ("وال", "بال", "كال", "فال", "لل", "ال")
+
+STOPWORDS = {
+    "في", "من", "علي", "الي", "عن", "مع", "ما", "ماذا", "هل", "هو", "هي", "هذا", "هذه",
+    "ذلك", "تلك", "التي", "الذي", "كيف", "او", "ثم", "قد", "كان", "كانت", "لا", "لم", "لن",
+    "ان", "انا", "نحن", "انت", "كل", "بين", "عند", "بعد", "قبل", "حتي", "يا", "و",
+    "the", "a", "an", "of", "to", "in", "on", "and", "or", "is", "are", "for", "with", "what", "how",
+}
+
+def normalize_arabic(text: str) -> str:
+    """
+    Fold spelling variants that users type interchangeably: alef/yeh/teh
+    marbuta forms, diacritics, tatweel and Arabic-Indic digits. Latin text is
+    case-folded.
+    """
+    text = unicodedata.normalize("NFKC", text)
+    text = _DIACRITICS.sub("", text).replace(_TATWEEL, "")
+    return text.translate(_CHAR_MAP).casefold()
+
+def _light_stem(token: str) -> str:
+    for prefix in _PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+            return token[len(prefix):]
+    return token
+
+def tokenize(text: str) -> list[str]:
+    """Normalized, lightly stemmed terms for lexical matching (stopwords removed)."""
+    terms = []
+    for token in _TOKEN.findall(normalize_arabic(text)):
+        if token in STOPWORDS:
+            continue
+        token = _light_stem(token)
+        if len(token) > 1 or token.isdigit():
+            terms.append(token)
+    return terms
@@ -0,0 +1,105 @@
+# bench_extract.py
+"""
+Parse-time micro-benchmark for website extraction: the old BeautifulSoup
+(html.parser) path against html_extract.extract_page (lxml), over a corpus
+of saved pages.
+
+    python bench_extract.py pages/            # every *.html file in a directory
+    python bench_extract.py --page-cache      # pages stored in PAGE_CACHE_DB
+    python bench_extract.py                   # generated sample pages
+
+Use --repeat to parse each page more times.
+"""
+import argparse
+import glob
+import os
+import sqlite3
+import statistics
+import sys
+import time
+import zlib
+from bs4 import BeautifulSoup
+from html_extract import extract_page
+
+def baseline_extract(page: str) -> dict:
+    """What website_analyzer did before html_extract: title, description and two paragraphs."""
+    soup = BeautifulSoup(page, 'html.parser')
+    meta_desc = soup.find('meta', {'name': ['description', 'Description']})
+    return {
+        'title': soup.title.string.strip() if soup.title and soup.title.string else '',
+        'description': meta_desc['content'].strip() if meta_desc and meta_desc.get('content') else '',
+        'content': ' '.join(p.get_text().strip() for p in soup.find_all('p', limit=2)),
+    }
+
+def _sample_page(sections: int) -> str:
+    """A marketing page in Arabic with the usual chrome, metadata and JSON-LD."""
+    menu = ''.join(f'<li><a href="/p{i}">قسم {i}</a></li>' for i in range(12))
+    body = ''.join(
+        f'<section><h2>خدماتنا رقم {i}</h2><p>نقدم حلولاً تسويقية متكاملة للشركات الصغيرة '
+        f'والمتوسطة في المملكة، تشمل إدارة الحملات والمحتوى والتحليلات. <a href="/s{i}">المزيد</a></p>'
+        f'<ul><li>إعلانات مدفوعة</li><li>تحسين محركات البحث</li><li>تسويق عبر البريد</li></ul>'
+        f'<div class="card"><img src="/i{i}.png" alt="صورة"><span>عرض خاص</span></div></section>'
+        for i in range(sections)
+    )
+    return (
+        '<!DOCTYPE html><html lang="ar" dir="rtl"><head><meta charset="utf-8">'
+        '<title>وكالة تسويق رقمي</title><meta name="description" content="وكالة تسويق رقمي في الرياض">'
+        '<meta property="og:title" content="وكالة تسويق"><meta property="og:site_name" content="وكالة">'
+        '<script type="application/ld+json">{"@context":"https://schema.org","@type":"Organization",'
+        '"name":"وكالة","url":"https://example.sa"}</script>'
+        '<style>body{font-family:sans-serif}</style></head><body>'
+        f'<header><nav><ul>{menu}</ul></nav></header><main><h1>نمو أعمالك يبدأ هنا</h1>{body}</main>'
+        '<footer><p>جميع الحقوق محفوظة</p></footer><script>window.dataLayer=[];</script></body></html>'
+    )
+
+def load_corpus(path: str = None, from_page_cache: bool = False) -> list[tuple[str, str]]:
+    """(name, html) pairs from a directory, the page cache, or generated samples."""
+    if from_page_cache:
+        from page_cache import PAGE_CACHE_DB
+        conn = sqlite3.connect(PAGE_CACHE_DB)
+        rows = conn.execute("SELECT url, body FROM pages").fetchall()
+        conn.close()
+        return [(url, zlib.decompress(body).decode('utf-8')) for url, body in rows]
+    if path:
+        pages = []
+        for file_path in sorted(glob.glob(os.path.join(path, '*.htm*'))):
+            with open(file_path, encoding='utf-8', errors='replace') as f:
+                pages.append((os.path.basename(file_path), f.read()))
+        return pages
+    return [(f'sample-{sections}-sections', _sample_page(sections)) for sections in (5, 40, 200, 1000)]
+
+def _time(func, page: str, repeat: int) -> float:
+    """Median seconds per parse."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(page)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark HTML extraction parse time")
+    parser.add_argument("corpus", nargs="?", help="directory of saved .html pages")
+    parser.add_argument("--page-cache", action="store_true", help="use the pages stored in the page cache")
+    parser.add_argument("--repeat", type=int, default=5, help="parses per page (median is reported)")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus, args.page_cache)
+    if not corpus:
+        print("No pages found", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"{'page':<40} {'KB':>8} {'bs4 ms':>9} {'lxml ms':>9} {'speedup':>8}")
+    total_old = total_new = 0.0
+    for name, page in corpus:
+        old = _time(baseline_extract, page, args.repeat)
+        new = _time(extract_page, page, args.repeat)
+        total_old += old
+        total_new += new
+        print(f"{name[:40]:<40} {len(page.encode('utf-8')) / 1024:>8.1f} {old * 1000:>9.2f} "
+              f"{new * 1000:>9.2f} {old / new if new else 0:>7.1f}x")
+    print(f"{'total':<40} {'':>8} {total_old * 1000:>9.2f} {total_new * 1000:>9.2f} "
+          f"{total_old / total_new if total_new else 0:>7.1f}x")
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,29 +1,154 @@
 # chroma_memory.py
 from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import OpenAIEmbeddings
 import os
+import threading
+import uuid
 from langchain.schema.document import Document
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from lexical_index import BM25Index
+from llm_provider import LLM_BACKEND, get_embedding_model
 
-CHROMA_DIR = "chroma_db"
+# Directory of the persisted vector store
+CHROMA_DIR = os.getenv("CHROMA_DIR", "chroma_db")
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Written by rag_loader after each ingestion run; a change triggers a reload
+INDEX_VERSION_FILE = "index_version"
+
+_embeddings = None
+_embedding_cache = None
+_vectordb = None
+_lexical_index = BM25Index()
+_loaded_version = None
+_lock = threading.RLock()
+
+def get_embeddings():
+    """Return the shared, cache-fronted embedding function (created once per process)."""
+    global _embeddings, _embedding_cache
+    if _embeddings is None:
+        with _lock:
+            if _embeddings is None:
+                _embedding_cache = EmbeddingCache()
+                _embeddings = CachedEmbeddings(
+                    get_embedding_model(EMBEDDING_MODEL),
+                    # Keep fake vectors out of the real model's cache entries
+                    model=EMBEDDING_MODEL if LLM_BACKEND == "openai" else f"{LLM_BACKEND}:{EMBEDDING_MODEL}",
+                    cache=_embedding_cache,
+                )
+    return _embeddings
+
+def get_embedding_cache_stats() -> dict:
+    return _embedding_cache.stats() if _embedding_cache else {}
+
+def publish_index_version(persist_directory=CHROMA_DIR) -> str:
+    """Mark the on-disk index as updated so running servers reopen it."""
+    version = uuid.uuid4().hex
+    path = os.path.join(persist_directory, INDEX_VERSION_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(version)
+    os.replace(tmp_path, path)
+    return version
+
+def _read_index_version(persist_directory=CHROMA_DIR):
+    try:
+        with open(os.path.join(persist_directory, INDEX_VERSION_FILE)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
 
 # Load Chroma vector DB (must match the directory used in rag_loader)
 def load_chroma():
     try:
-        embeddings = OpenAIEmbeddings(model="text-embedding-3-small", openai_api_key=os.getenv("OPENAI_API_KEY"))
-        vectordb = Chroma(persist_directory=CHROMA_DIR, embedding_function=embeddings)
+        vectordb = Chroma(persist_directory=CHROMA_DIR, embedding_function=get_embeddings())
         return vectordb
     except Exception as e:
         print(f"Failed to load Chroma DB: {e}")
         return None
 
+def _build_lexical_index(vectordb, page_size=1000) -> BM25Index:
+    """Build the BM25 index from the chunks currently stored in Chroma."""
+    index = BM25Index()
+    offset = 0
+    while True:
+        page = vectordb._collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        for chunk_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+            index.add(chunk_id, text or "", metadata)
+        if len(page["ids"]) < page_size:
+            return index
+        offset += page_size
+
+def get_vectordb():
+    """
+    Return the process-wide vector store, opening it on first use and
+    reopening it only when rag_loader has published a new index version.
+    """
+    global _vectordb, _lexical_index, _loaded_version
+    version = _read_index_version()
+    if _vectordb is not None and version == _loaded_version:
+        return _vectordb
+    with _lock:
+        if _vectordb is None or version != _loaded_version:
+            if _vectordb is not None:
+                # Chroma caches one client system per directory; drop it so the
+                # new index files are actually re-read from disk.
+                from chromadb.api.client import SharedSystemClient
+                SharedSystemClient.clear_system_cache()
+                print(f"Reloading Chroma DB (index version {version})")
+            vectordb = load_chroma()
+            if vectordb is not None:
+                # The lexical index always mirrors the loaded vector index
+                try:
+                    _lexical_index = _build_lexical_index(vectordb)
+                except Exception as e:
+                    print(f"Failed to build lexical index: {e}")
+                    _lexical_index = BM25Index()
+                _vectordb = vectordb
+                _loaded_version = version
+        return _vectordb
+
+def vector_search(query: str, top_k=4) -> list[tuple[str, Document]]:
+    """Nearest chunks by embedding similarity, as (chunk_id, Document) pairs."""
+    vectordb = get_vectordb()
+    if vectordb is None:
+        return []
+    embedding = get_embeddings().embed_query(query)
+    result = vectordb._collection.query(
+        query_embeddings=[embedding],
+        n_results=top_k,
+        include=["documents", "metadatas"],
+    )
+    return [
+        (chunk_id, Document(page_content=text or "", metadata=metadata or {}))
+        for chunk_id, text, metadata in zip(result["ids"][0], result["documents"][0], result["metadatas"][0])
+    ]
+
+def embed_query(query: str) -> list[float]:
+    return get_embeddings().embed_query(query)
+
+def get_chunk_embeddings(chunk_ids: list[str]) -> list:
+    """Stored embeddings for the given chunk IDs, in order (None where missing)."""
+    vectordb = get_vectordb()
+    if vectordb is None or not chunk_ids:
+        return [None] * len(chunk_ids)
+    result = vectordb._collection.get(ids=list(chunk_ids), include=["embeddings"])
+    by_id = dict(zip(result["ids"], result["embeddings"]))
+    return [by_id.get(chunk_id) for chunk_id in chunk_ids]
+
+def lexical_search(query: str, top_k=4) -> list[tuple[str, Document]]:
+    """Best BM25 matches over the normalized chunk text, as (chunk_id, Document) pairs."""
+    get_vectordb()  # picks up a newly published index
+    index = _lexical_index
+    results = []
+    for chunk_id, _ in index.search(query, k=top_k):
+        text, metadata = index.documents[chunk_id]
+        results.append((chunk_id, Document(page_content=text, metadata=metadata)))
+    return results
+
 # Search for relevant chunks given a query
 def query_memory(query: str, top_k=4) -> list[Document]:
     try:
-        vectordb = load_chroma()
-        if vectordb is None:
-            return []
-        results = vectordb.similarity_search(query, k=top_k)
-        return results
+        return [doc for _, doc in vector_search(query, top_k=top_k)]
     except Exception as e:
         print(f"Failed to query memory: {e}")
         return []
@@ -1,66 +1,92 @@
 # conversation_flow.py
-from user_profile import (
-    get_conversation_stage, update_conversation_stage, 
-    get_next_question, update_user_profile, is_profile_complete,
-    get_profile_summary
-)
+from user_profile import is_profile_complete, get_profile_summary, digest_columns, ProfileSession
+from thread_pool import run_blocking
+from admission import Overloaded
 import re
 
-def process_user_response(user_id: str, message: str) -> dict:
+async def process_user_response(user_id: str, message: str, session: ProfileSession = None) -> dict:
     """
-    Process user response and determine next action
+    Process user response and determine next action.
+
+    When a request-scoped session is passed, updates are staged on it and the
+    caller is responsible for committing; otherwise they are committed here.
     """
-    stage = get_conversation_stage(user_id)
+    owns_session = session is None
+    if owns_session:
+        session = await run_blocking(ProfileSession, user_id)
+    stage = session.stage
     
     # Extract information based on current stage
     extracted_info = extract_information(stage, message)
     
     # Update user profile with extracted information
     if extracted_info:
-        update_user_profile(user_id, **extracted_info)
+        session.update(**extracted_info)
     
     # If this is a website URL, analyze it
     if stage == 'goals' and extracted_info.get('website_url'):
-        website_analysis = analyze_website_for_profile(extracted_info['website_url'])
-        if website_analysis:
-            update_user_profile(user_id, website_analysis=website_analysis)
+        website_fields = await analyze_website_for_profile(extracted_info['website_url'], session.profile)
+        session.update(**website_fields)
     
     # Move to next stage only if we extracted information
     if extracted_info:
         next_stage = get_next_stage(stage)
-        update_conversation_stage(user_id, next_stage)
+        session.update(conversation_stage=next_stage)
     else:
         next_stage = stage  # Stay in current stage if no info extracted
     
+    if owns_session:
+        await run_blocking(session.commit)
+    
     # Check if profile is complete
-    profile_complete = is_profile_complete(user_id)
+    profile_complete = session.is_complete()
     
     return {
         'stage': next_stage,
         'extracted_info': extracted_info,
         'profile_complete': profile_complete,
-        'next_question': get_next_question(user_id) if not profile_complete else None
+        'next_question': session.next_question() if not profile_complete else None
     }
 
-def analyze_website_for_profile(website_url: str) -> str:
+async def analyze_website_for_profile(website_url: str, user_profile: dict = None) -> dict:
     """
-    Analyze website and extract company information for profile
+    Analyze website and extract company information for profile.
+
+    Returns the profile fields to store: the full report (kept for display)
+    and, when the analysis succeeded, the compact digest used in prompts.
+    When only the report's model call failed, just the digest is returned.
+    The report is personalized with user_profile, so a later /analyze-website
+    call for the same site reuses it from the report cache.
     """
     try:
-        from website_analyzer import analyze_website, generate_analysis_report
+        from website_analyzer import build_analysis_report
+        from llm_provider import LLMError
+        from site_crawler import crawl_site
+        from profile_digest import distill_profile
         
-        # Analyze the website
-        website_data = analyze_website(website_url)
+        # Analyze the website: homepage plus its about/services/pricing/contact pages
+        website_data = await crawl_site(website_url)
         
         if website_data.get('status') == 'success':
             # Generate analysis report
-            analysis_report = generate_analysis_report(website_data)
-            return analysis_report
+            try:
+                analysis_report = await build_analysis_report(website_data, user_profile)
+            except LLMError as e:
+                # No report to keep: storing the apology would put it in later
+                # prompts, so only the digest of the page itself is saved
+                print(f"Website report failed for {website_url}: {e}")
+                digest = await distill_profile(website_data)
+                return digest_columns(digest)
+            # Distill it once, so later turns don't carry the whole report
+            digest = await distill_profile(website_data, analysis_report)
+            return {'website_analysis': analysis_report, **digest_columns(digest)}
         else:
-            return f"عذراً، لم أتمكن من تحليل الموقع: {website_data.get('error', 'خطأ غير معروف')}"
+            return {'website_analysis': f"عذراً، لم أتمكن من تحليل الموقع: {website_data.get('error', 'خطأ غير معروف')}"}
             
+    except Overloaded:
+        raise  # the user resends the URL after the 429; the stage stays at 'goals'
     except Exception as e:
-        return f"عذراً، حدث خطأ في تحليل الموقع: {str(e)}"
+        return {'website_analysis': f"عذراً، حدث خطأ في تحليل الموقع: {str(e)}"}
 
 def extract_information(stage: str, message: str) -> dict:
     """
@@ -170,8 +196,10 @@ def get_next_stage(current_stage: str) -> str:
     except ValueError:
         return 'greeting'
 
-def should_continue_profile_building(user_id: str) -> bool:
+def should_continue_profile_building(user_id: str, session: ProfileSession = None) -> bool:
     """Check if we should continue building the profile"""
+    if session is not None:
+        return not session.is_complete()
     return not is_profile_complete(user_id)
 
 def get_personalized_response(user_id: str, message: str) -> str:
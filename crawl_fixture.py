@@ -0,0 +1,145 @@
+# crawl_fixture.py
+"""
+Offline check of the site crawler: serves a small Arabic fixture site on
+localhost (robots.txt, a sitemap index, menu links, a disallowed page and a
+slow page) and crawls it. Prints the pages picked, the merged summary and
+whether each expectation held; exits non-zero if one did not.
+
+    python crawl_fixture.py [--budget 4]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_workdir = tempfile.mkdtemp(prefix="morvo-crawl-")
+os.environ["FETCH_BLOCK_PRIVATE"] = "false"  # the fixture lives on 127.0.0.1
+os.environ.setdefault("OPENAI_API_KEY", "offline")
+os.environ.setdefault("PAGE_CACHE_DB", os.path.join(_workdir, "page_cache.db"))
+os.environ.setdefault("REPORT_CACHE_DB", os.path.join(_workdir, "report_cache.db"))
+
+def _page(title: str, body: str) -> bytes:
+    menu = ('<nav><ul><li><a href="/">الرئيسية</a></li><li><a href="/about-us">من نحن</a></li>'
+            '<li><a href="/services">خدماتنا</a></li><li><a href="/blog/2021/office">المدونة</a></li>'
+            '<li><a href="/private/contact-admin">الإدارة</a></li><li><a href="/contact">تواصل معنا</a></li>'
+            '<li><a href="/brochure.pdf">الكتيب</a></li></ul></nav>')
+    return (f'<!DOCTYPE html><html lang="ar"><head><title>{title}</title>'
+            f'<meta name="description" content="{title} - محمصة بن"></head>'
+            f'<body><header>{menu}</header><main><h1>{title}</h1>{body}</main></body></html>').encode('utf-8')
+
+PAGES = {
+    '/': _page('محمصة بن', '<p>نحمص القهوة المختصة يومياً في الرياض.</p>'),
+    '/about-us': _page('من نحن', '<p>بدأنا عام 2015 بمحمصة صغيرة ونخدم اليوم أكثر من مئة مقهى.</p>'),
+    '/services': _page('خدماتنا', '<ul><li>تحميص حسب الطلب</li><li>تدريب الباريستا</li></ul>'),
+    '/pricing': _page('الأسعار', '<p>باقة المقاهي تبدأ من 900 ريال شهرياً.</p>'),
+    '/contact': _page('تواصل معنا', '<p>الرياض، حي العليا. واتساب 0500000000.</p>'),
+    '/private/contact-admin': _page('الإدارة', '<p>صفحة داخلية</p>'),
+    '/blog/2021/office': _page('مكتبنا الجديد', '<p>انتقلنا إلى مكتب جديد.</p>'),
+}
+ROBOTS = "User-agent: *\nDisallow: /private/\nCrawl-delay: 0.2\nSitemap: http://{host}/sitemap_index.xml\n"
+SITEMAP_INDEX = ('<?xml version="1.0" encoding="UTF-8"?><sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+                 '<sitemap><loc>http://{host}/sitemap-pages.xml</loc></sitemap></sitemapindex>')
+SITEMAP = ('<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+           + ''.join(f'<url><loc>http://{{host}}{path}</loc></url>' for path in ('/', '/pricing', '/services', '/blog/2021/office'))
+           + '</urlset>')
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    slow_paths = set()
+    requests = []
+
+    def do_GET(self):
+        FixtureHandler.requests.append((time.monotonic(), self.path))
+        host = self.headers.get('Host')
+        if self.path == '/robots.txt':
+            return self._send(200, ROBOTS.format(host=host).encode(), 'text/plain')
+        if self.path == '/sitemap_index.xml':
+            return self._send(200, SITEMAP_INDEX.format(host=host).encode(), 'application/xml')
+        if self.path == '/sitemap-pages.xml':
+            return self._send(200, SITEMAP.format(host=host).encode(), 'application/xml')
+        if self.path in PAGES:
+            if self.path in self.slow_paths:
+                time.sleep(30)
+            return self._send(200, PAGES[self.path], 'text/html; charset=utf-8')
+        self._send(404, b'', 'text/plain')
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def serve() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+async def run(budget: float) -> bool:
+    os.environ["CRAWL_TIME_BUDGET"] = str(budget)
+    import site_crawler
+    from http_fetcher import aclose
+    server = serve()
+    base = f"http://127.0.0.1:{server.server_port}"
+    ok = True
+
+    def check(label: str, passed: bool):
+        nonlocal ok
+        ok = ok and passed
+        print(f"{'PASS' if passed else 'FAIL'}  {label}")
+
+    started = time.monotonic()
+    site = await site_crawler.crawl_site(base + '/')
+    elapsed = time.monotonic() - started
+    paths = [page['url'][len(base):] for page in site.get('pages', [])]
+    print(f"crawled in {elapsed:.2f}s: {paths}")
+    print(f"keywords: {site.get('keywords')}")
+    check("homepage analyzed", site.get('status') == 'success' and site.get('title') == 'محمصة بن')
+    check("about, services, pricing and contact picked", sorted(paths) == ['/about-us', '/contact', '/pricing', '/services'])
+    check("pricing found through the sitemap index", '/pricing' in paths)
+    fetched = [path for _, path in FixtureHandler.requests]
+    check("robots.txt disallow honoured", not any(path.startswith('/private/') for path in fetched))
+    check("irrelevant and non-HTML links skipped", '/blog/2021/office' not in fetched and '/brochure.pdf' not in fetched)
+    page_starts = [at for at, path in FixtureHandler.requests if path in PAGES and path != '/']
+    gaps = [b - a for a, b in zip(page_starts, page_starts[1:])]
+    check("request starts spaced by the crawl delay", all(gap >= 0.15 for gap in gaps))
+    check("links are not part of the summary", 'links' not in site)
+
+    # A repeat analysis is served from the page cache, robots.txt and sitemaps included
+    FixtureHandler.requests.clear()
+    await site_crawler.crawl_site(base + '/')
+    check("repeat crawl served from the page cache", not FixtureHandler.requests)
+
+    # A page that never answers is dropped when the budget runs out
+    FixtureHandler.slow_paths.add('/contact')
+    FixtureHandler.requests.clear()
+    from page_cache import page_cache
+    page_cache._conn.execute("DELETE FROM pages")
+    started = time.monotonic()
+    site = await site_crawler.crawl_site(base + '/')
+    elapsed = time.monotonic() - started
+    paths = [page['url'][len(base):] for page in site.get('pages', [])]
+    print(f"with a slow /contact, crawled in {elapsed:.2f}s: {paths}")
+    check("time budget respected", elapsed < budget + 1.5)
+    check("slow page dropped, others kept", '/contact' not in paths and '/about-us' in paths)
+    print(f"stats: {site_crawler.get_crawler_stats()}")
+
+    await aclose()
+    server.shutdown()
+    return ok
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Crawl a local fixture site and check the crawler's choices")
+    parser.add_argument("--budget", type=float, default=4.0, help="crawl time budget in seconds")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args.budget)) else 1)
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,144 @@
+# embedding_cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from langchain_core.embeddings import Embeddings
+from admission import embedding_slot
+
+EMBEDDING_CACHE_DB = os.getenv("EMBEDDING_CACHE_DB", "embedding_cache.db")
+# Number of vectors kept in memory in front of the on-disk store
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "2048"))
+# Vectors kept on disk, and days each one is kept; the oldest go first
+EMBEDDING_CACHE_DISK_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_DISK_MAX_ENTRIES", "100000"))
+EMBEDDING_CACHE_TTL_DAYS = float(os.getenv("EMBEDDING_CACHE_TTL_DAYS", "30"))
+
+def normalize_query(text: str) -> str:
+    """Canonical form used for cache keys: NFKC, case-folded, single-spaced."""
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+def _cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+def _to_blob(vector) -> bytes:
+    return array('f', vector).tobytes()
+
+def _from_blob(blob: bytes) -> list[float]:
+    vector = array('f')
+    vector.frombytes(blob)
+    return vector.tolist()
+
+class EmbeddingCache:
+    """
+    Two-level cache of query embeddings: an in-memory LRU backed by a SQLite
+    table of float32 blobs, keyed by model name and normalized text. The
+    table drops vectors older than ttl_days and the oldest beyond
+    disk_max_entries.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_DB, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+                 disk_max_entries: int = EMBEDDING_CACHE_DISK_MAX_ENTRIES, ttl_days: float = EMBEDDING_CACHE_TTL_DAYS):
+        self.max_entries = max_entries
+        self.disk_max_entries = disk_max_entries
+        self.ttl = timedelta(days=ttl_days)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                vector BLOB,
+                created_at TEXT
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_created_at ON embeddings (created_at)")
+        self._conn.commit()
+
+    def _cutoff(self) -> str:
+        return (datetime.utcnow() - self.ttl).isoformat()
+
+    def _remember(self, key: str, vector: list[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, model: str, text: str):
+        key = _cache_key(model, text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return vector
+            row = self._conn.execute("SELECT vector, created_at FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._stats['misses'] += 1
+                return None
+            if row[1] < self._cutoff():
+                self._conn.execute("DELETE FROM embeddings WHERE key = ?", (key,))
+                self._conn.commit()
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return None
+            vector = _from_blob(row[0])
+            self._remember(key, vector)
+            self._stats['disk_hits'] += 1
+            return vector
+
+    def put(self, model: str, text: str, vector: list[float]):
+        key = _cache_key(model, text)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, created_at) VALUES (?, ?, ?, ?)",
+                (key, model, _to_blob(vector), datetime.utcnow().isoformat())
+            )
+            self._stats['expired'] += self._conn.execute(
+                "DELETE FROM embeddings WHERE created_at < ?", (self._cutoff(),)
+            ).rowcount
+            overflow = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.disk_max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY created_at LIMIT ?)",
+                    (overflow,)
+                )
+                self._stats['evictions'] += overflow
+            self._conn.commit()
+            self._remember(key, list(vector))
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self._stats['memory_hits'] + self._stats['disk_hits']
+            lookups = hits + self._stats['misses']
+            return {
+                **self._stats,
+                'memory_entries': len(self._memory),
+                'disk_entries': self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0],
+                'hit_rate': hits / lookups if lookups else 0.0,
+            }
+
+class CachedEmbeddings(Embeddings):
+    """Embedding function that answers repeated queries from an EmbeddingCache."""
+
+    def __init__(self, embeddings: Embeddings, model: str, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+
+    def embed_query(self, text: str) -> list[float]:
+        vector = self.cache.get(self.model, text)
+        if vector is None:
+            with embedding_slot():
+                vector = self.embeddings.embed_query(text)
+            self.cache.put(self.model, text, vector)
+        return vector
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        # Document embeddings are only computed at ingestion time; no caching
+        return self.embeddings.embed_documents(texts)
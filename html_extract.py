@@ -0,0 +1,152 @@
+# html_extract.py
+import json
+import re
+from lxml import etree, html as lxml_html
+
+# Limits on what is kept from one page
+MAX_HEADINGS = 12
+MAX_BLOCKS = 40
+MAIN_TEXT_CHARS = 3000
+MAX_LINKS = 2000
+
+# Subtrees that are page chrome rather than content
+SKIP_TAGS = {'script', 'style', 'noscript', 'template', 'svg', 'nav', 'header', 'footer', 'aside', 'form', 'iframe'}
+MAIN_TAGS = {'main', 'article'}
+HEADING_TAGS = {'h1', 'h2', 'h3'}
+BLOCK_TAGS = {'p', 'li', 'blockquote', 'td', 'dd'}
+OPENGRAPH_FIELDS = ('title', 'description', 'site_name', 'type', 'url', 'image', 'locale')
+ORGANIZATION_TYPES = {'organization', 'corporation', 'localbusiness', 'store', 'onlinestore', 'brand',
+                      'restaurant', 'cafeorcoffeeshop', 'professionalservice', 'educationalorganization'}
+
+_parser = lxml_html.HTMLParser(encoding='utf-8', remove_comments=True, remove_pis=True)
+
+def _clean(text: str) -> str:
+    return ' '.join((text or '').split())
+
+def _split_keywords(value: str) -> list[str]:
+    return [k.strip() for k in re.split(r'[,،]', value or '') if k.strip()]
+
+def _organization(data) -> dict:
+    """First schema.org organization-like object in a JSON-LD document, flattened."""
+    stack = [data]
+    while stack:
+        item = stack.pop(0)
+        if isinstance(item, list):
+            stack.extend(item)
+            continue
+        if not isinstance(item, dict):
+            continue
+        stack.extend(item.get('@graph') or [])
+        types = item.get('@type') or []
+        types = [types] if isinstance(types, str) else types
+        if not any(str(t).casefold() in ORGANIZATION_TYPES for t in types):
+            continue
+        address = item.get('address')
+        if isinstance(address, dict):
+            address = ', '.join(_clean(str(address[part])) for part in
+                                ('streetAddress', 'addressLocality', 'addressRegion', 'addressCountry')
+                                if isinstance(address.get(part), str))
+        same_as = item.get('sameAs') or []
+        organization = {
+            'type': str(types[0]),
+            'name': item.get('name'),
+            'description': item.get('description'),
+            'url': item.get('url'),
+            'telephone': item.get('telephone'),
+            'address': address if isinstance(address, str) else None,
+            'same_as': [same_as] if isinstance(same_as, str) else [s for s in same_as if isinstance(s, str)],
+        }
+        return {key: _clean(value) if isinstance(value, str) else value
+                for key, value in organization.items() if value}
+    return {}
+
+def extract_page(page: str) -> dict:
+    """
+    Parse a page with lxml and pull out, in a single walk over the tree:
+    title, meta description and keywords, OpenGraph tags, the JSON-LD
+    organization, h1-h3 headings, the main text and links (href, text) as
+    written. Text inside <main> or <article> is preferred; navigation,
+    headers, footers and scripts are skipped for text but not for links.
+    Missing fields come back empty.
+    """
+    result = {
+        'title': '', 'description': '', 'keywords': [], 'lang': '',
+        'opengraph': {}, 'organization': {}, 'headings': [], 'main_text': '', 'links': [],
+    }
+    if not page or not page.strip():
+        return result
+    try:
+        root = lxml_html.document_fromstring(page.encode('utf-8', errors='replace'), parser=_parser)
+    except (etree.ParserError, ValueError):
+        return result
+    result['lang'] = (root.get('lang') or '').strip()
+
+    main_blocks = []
+    other_blocks = []
+    skip_depth = 0
+    main_depth = 0
+    block_depth = 0
+    for event, element in etree.iterwalk(root, events=('start', 'end')):
+        tag = element.tag if isinstance(element.tag, str) else ''
+        if event == 'end':
+            if tag in SKIP_TAGS:
+                skip_depth -= 1
+            elif tag in MAIN_TAGS:
+                main_depth -= 1
+            elif (tag in BLOCK_TAGS or tag in HEADING_TAGS) and not skip_depth:
+                block_depth -= 1
+            continue
+
+        if tag == 'meta':
+            name = (element.get('name') or element.get('property') or '').strip().lower()
+            content = _clean(element.get('content'))
+            if not content:
+                continue
+            if name == 'description' and not result['description']:
+                result['description'] = content
+            elif name == 'keywords' and not result['keywords']:
+                result['keywords'] = _split_keywords(content)
+            elif name.startswith('og:') and name[3:] in OPENGRAPH_FIELDS:
+                result['opengraph'].setdefault(name[3:], content)
+            continue
+        if tag == 'title' and not result['title']:
+            result['title'] = _clean(element.text_content())
+            continue
+        if tag == 'script':
+            if not result['organization'] and (element.get('type') or '').lower() == 'application/ld+json':
+                try:
+                    result['organization'] = _organization(json.loads(element.text or ''))
+                except ValueError:
+                    pass
+            skip_depth += 1
+            continue
+        if tag == 'a':
+            # Menus and footers are where about/pricing/contact links live
+            href = (element.get('href') or '').strip()
+            if href and not href.startswith(('#', 'javascript:', 'mailto:', 'tel:')) and len(result['links']) < MAX_LINKS:
+                result['links'].append((href, _clean(element.text_content())[:80]))
+        if tag in SKIP_TAGS:
+            skip_depth += 1
+            continue
+        if tag in MAIN_TAGS:
+            main_depth += 1
+            continue
+        if skip_depth:
+            continue
+
+        if tag in HEADING_TAGS or tag in BLOCK_TAGS:
+            block_depth += 1
+            if block_depth > 1:
+                continue  # text already taken with the enclosing block
+            text = _clean(element.text_content())
+            if not text:
+                continue
+            if tag in HEADING_TAGS and len(result['headings']) < MAX_HEADINGS:
+                result['headings'].append(text)
+            elif tag in BLOCK_TAGS:
+                blocks = main_blocks if main_depth else other_blocks
+                if len(blocks) < MAX_BLOCKS:
+                    blocks.append(text)
+
+    result['main_text'] = ' '.join(main_blocks or other_blocks)[:MAIN_TEXT_CHARS]
+    return result
@@ -0,0 +1,216 @@
+# http_fetcher.py
+import asyncio
+import ipaddress
+import os
+import re
+import socket
+import threading
+import time
+from collections import Counter
+from urllib.parse import urljoin, urlsplit
+import httpx
+from request_context import bounded_timeout
+
+# Timeouts (seconds): to connect, between two chunks of the body, and for the
+# whole fetch including redirects (also cut to the request deadline)
+FETCH_CONNECT_TIMEOUT = float(os.getenv("FETCH_CONNECT_TIMEOUT", "5"))
+FETCH_READ_TIMEOUT = float(os.getenv("FETCH_READ_TIMEOUT", "10"))
+FETCH_TOTAL_TIMEOUT = float(os.getenv("FETCH_TOTAL_TIMEOUT", "20"))
+# Most bytes read from one page (after decompression)
+FETCH_MAX_BYTES = int(os.getenv("FETCH_MAX_BYTES", str(2 * 1024 * 1024)))
+# Reading stops once </head> and this many content blocks (</p>, </h1>…) are in.
+# Blocks count only outside menus (nav, header, footer, lists) and only from
+# <main>/<article>, or after FETCH_MIN_BODY_BYTES of body on pages without one
+FETCH_CONTENT_BLOCKS = int(os.getenv("FETCH_CONTENT_BLOCKS", "40"))
+FETCH_MIN_BODY_BYTES = int(os.getenv("FETCH_MIN_BODY_BYTES", str(64 * 1024)))
+# Connection pool of the shared client
+FETCH_MAX_CONNECTIONS = int(os.getenv("FETCH_MAX_CONNECTIONS", "20"))
+FETCH_MAX_KEEPALIVE = int(os.getenv("FETCH_MAX_KEEPALIVE", "10"))
+# Check TLS certificates; turn off only for sites with broken certificates
+FETCH_VERIFY_TLS = os.getenv("FETCH_VERIFY_TLS", "true").lower() in ("1", "true", "yes")
+# Refuse hosts that resolve to private, loopback or link-local addresses
+FETCH_BLOCK_PRIVATE = os.getenv("FETCH_BLOCK_PRIVATE", "true").lower() in ("1", "true", "yes")
+MAX_REDIRECTS = 5
+USER_AGENT = "Mozilla/5.0 (compatible; MorvoBot/1.0)"
+HTML_TYPES = ('text/html', 'application/xhtml+xml', 'text/plain')
+
+HEAD_END = re.compile(rb'</head\s*>', re.IGNORECASE)
+# Tags that open or close a menu, the main content, or a content block
+BODY_TAG = re.compile(rb'<(/?)(nav|header|footer|aside|ul|ol|main|article|p|h[1-6]|blockquote)(?=[\s/>])[^<>]{0,200}>',
+                      re.IGNORECASE)
+MENU_TAGS = {b'nav', b'header', b'footer', b'aside', b'ul', b'ol'}
+MAIN_TAGS = {b'main', b'article'}
+# Bytes kept from the previous chunk so a tag split across chunks is still seen
+TAG_OVERLAP = 256
+
+_client = None
+_lock = threading.Lock()
+_stats = Counter()
+
+class FetchError(Exception):
+    """The page was not fetched (blocked, not HTML, or an HTTP error); the message is for the user."""
+
+def get_client() -> httpx.AsyncClient:
+    """Return the process-wide keep-alive client used for website fetches."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = httpx.AsyncClient(
+                    headers={'User-Agent': USER_AGENT, 'Accept': 'text/html,application/xhtml+xml;q=0.9,*/*;q=0.5'},
+                    timeout=httpx.Timeout(FETCH_READ_TIMEOUT, connect=FETCH_CONNECT_TIMEOUT),
+                    limits=httpx.Limits(max_connections=FETCH_MAX_CONNECTIONS,
+                                        max_keepalive_connections=FETCH_MAX_KEEPALIVE),
+                    verify=FETCH_VERIFY_TLS,
+                    follow_redirects=False,  # followed by hand so every hop is checked
+                )
+    return _client
+
+async def aclose():
+    """Close the pooled connections; called on app shutdown."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+    _client = None
+
+def _is_public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split('%')[0])
+    return ip.is_global and not ip.is_multicast
+
+async def _check_url(url: str):
+    """
+    Reject schemes other than http(s) and, if enabled, hosts on private
+    networks. Returns the checked address to connect to, or None when the
+    check is off.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise FetchError('الرابط غير صالح. يرجى إرسال رابط يبدأ بـ http أو https.')
+    if not FETCH_BLOCK_PRIVATE:
+        return None
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80), type=socket.SOCK_STREAM)
+    except socket.gaierror:
+        raise FetchError('تعذر العثور على هذا الموقع. يرجى التأكد من الرابط.')
+    if not all(_is_public(info[4][0]) for info in infos):
+        _stats['blocked'] += 1
+        raise FetchError('لا يمكن تحليل هذا العنوان لأنه يشير إلى شبكة داخلية.')
+    return infos[0][4][0].split('%')[0]
+
+def _pinned(url: str, address: str, headers: dict):
+    """
+    (url, headers, extensions) that connect to the already checked address
+    instead of resolving the host again, which a DNS-rebinding host could
+    answer with a private address. Host and TLS SNI keep the real name, so
+    virtual hosts and certificate checks work as before.
+    """
+    target = httpx.URL(url)
+    if address is None:
+        return target, headers, {}
+    return (target.copy_with(host=address),
+            {**headers, 'Host': target.netloc.decode('ascii')},
+            {'sni_hostname': target.raw_host.decode('ascii')})
+
+async def _read_body(response: httpx.Response, deadline: float, early_stop: bool = True):
+    """
+    Read the body up to FETCH_MAX_BYTES, stopping early (if allowed) once the
+    head and the first content blocks are in, or when the time is up. Returns
+    (bytes, reason) where reason is None for a complete body.
+    """
+    chunks = []
+    size = 0
+    head_end = None  # body offset where </head> ends
+    menu_depth = 0
+    in_main = False
+    blocks = 0
+    tail = b''
+    async for chunk in response.aiter_bytes():
+        chunks.append(chunk)
+        size += len(chunk)
+        window = tail + chunk
+        if early_stop:
+            start = 0
+            if head_end is None:
+                match = HEAD_END.search(window)
+                if match:
+                    head_end = size - len(window) + match.end()
+                    start = match.end()
+            if head_end is not None:
+                for match in BODY_TAG.finditer(window, start):
+                    if match.end() <= len(tail):
+                        continue  # seen with the previous chunk
+                    closing, tag = match.group(1), match.group(2).lower()
+                    if tag in MENU_TAGS:
+                        menu_depth = max(menu_depth - 1, 0) if closing else menu_depth + 1
+                    elif tag in MAIN_TAGS:
+                        in_main = in_main or not closing
+                    elif closing and not menu_depth and (in_main or size - head_end >= FETCH_MIN_BODY_BYTES):
+                        blocks += 1
+        tail = chunk[-TAG_OVERLAP:]
+        if blocks >= FETCH_CONTENT_BLOCKS:
+            return b''.join(chunks), 'early_stop'
+        if size >= FETCH_MAX_BYTES:
+            return b''.join(chunks)[:FETCH_MAX_BYTES], 'max_bytes'
+        if time.monotonic() >= deadline:
+            return b''.join(chunks), 'time_budget'
+    return b''.join(chunks), None
+
+async def _fetch(url: str, headers: dict, deadline: float, content_types: tuple, early_stop: bool) -> dict:
+    client = get_client()
+    for _ in range(MAX_REDIRECTS + 1):
+        request_url, request_headers, extensions = _pinned(url, await _check_url(url), headers)
+        async with client.stream('GET', request_url, headers=request_headers, extensions=extensions) as response:
+            if response.is_redirect and 'location' in response.headers:
+                url = urljoin(url, response.headers['location'])
+                continue
+            if response.status_code == 304:
+                return {'url': url, 'status_code': 304, 'headers': response.headers, 'text': '', 'stopped': None}
+            if response.status_code >= 400:
+                raise FetchError(f'الموقع أعاد رمز الخطأ {response.status_code}.')
+            content_type = response.headers.get('content-type', 'text/html').split(';')[0].strip().lower()
+            if content_type not in content_types:
+                _stats['not_html'] += 1
+                raise FetchError('الرابط لا يشير إلى صفحة ويب يمكن تحليلها.')
+            body, stopped = await _read_body(response, deadline, early_stop)
+            _stats['bytes'] += len(body)
+            if stopped:
+                _stats[stopped] += 1
+            return {
+                'url': url,
+                'status_code': response.status_code,
+                'headers': response.headers,
+                'text': body.decode(response.encoding or 'utf-8', errors='replace'),
+                'stopped': stopped,
+            }
+    raise FetchError('الموقع يعيد التوجيه مرات كثيرة.')
+
+async def fetch_page(url: str, headers: dict = None, content_types: tuple = HTML_TYPES,
+                     early_stop: bool = True) -> dict:
+    """
+    GET a web page through the shared client. Returns a dict with the final
+    url, status_code, headers, text and stopped (why reading ended early, or
+    None). early_stop=False reads the whole page (up to the byte cap), e.g.
+    when its footer links are needed. Raises FetchError for blocked pages or other content types and
+    httpx.TimeoutException when the total time budget runs out.
+    """
+    budget = bounded_timeout(FETCH_TOTAL_TIMEOUT)
+    started = time.monotonic()
+    _stats['fetches'] += 1
+    try:
+        # Reading stops at the deadline; the outer limit also covers a stalled connect or read
+        return await asyncio.wait_for(_fetch(url, headers or {}, started + budget, content_types, early_stop), budget + 1)
+    except asyncio.TimeoutError:
+        _stats['timeouts'] += 1
+        raise httpx.ReadTimeout(f"fetch of {url} exceeded {budget:.0f}s")
+    finally:
+        _stats['seconds'] += time.monotonic() - started
+
+def get_fetcher_stats() -> dict:
+    fetches = _stats['fetches']
+    return {
+        **_stats,
+        'seconds': round(_stats['seconds'], 3),
+        'mean_seconds': round(_stats['seconds'] / fetches, 3) if fetches else 0.0,
+        'byte_cap': FETCH_MAX_BYTES,
+    }
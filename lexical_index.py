@@ -0,0 +1,44 @@
+# lexical_index.py
+import math
+from collections import Counter, defaultdict
+from arabic_text import tokenize
+
+class BM25Index:
+    """In-memory inverted index over the chunks stored in Chroma, scored with BM25."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)  # term -> {chunk_id: term frequency}
+        self.lengths = {}
+        self.documents = {}  # chunk_id -> (text, metadata)
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, chunk_id: str, text: str, metadata: dict = None):
+        terms = Counter(tokenize(text))
+        for term, frequency in terms.items():
+            self.postings[term][chunk_id] = frequency
+        length = sum(terms.values())
+        self.lengths[chunk_id] = length
+        self.total_length += length
+        self.documents[chunk_id] = (text, metadata or {})
+
+    def search(self, query: str, k: int = 4) -> list[tuple[str, float]]:
+        """Return up to k (chunk_id, score) pairs, best first."""
+        if not self.documents:
+            return []
+        count = len(self.documents)
+        average_length = self.total_length / count or 1.0
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, frequency in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[chunk_id] / average_length)
+                scores[chunk_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
@@ -1,92 +1,169 @@
 # llm.py
-import os
 from dotenv import load_dotenv
-from openai import OpenAI
-from rag_retriever import retrieve_context
-from conversation_flow import process_user_response, should_continue_profile_building, get_personalized_response
-from user_profile import get_profile_summary, get_conversation_stage
+from llm_provider import chat_completion, stream_completion
+import time
+from retrieval_gate import gated_context, should_retrieve
+from model_router import route, record_latency
+from prompt_builder import build_messages
+import response_cache
+from conversation_flow import process_user_response, should_continue_profile_building
+from user_profile import ProfileSession
+from thread_pool import run_blocking
 
 load_dotenv()
-OPENAI_MODEL = "gpt-4"
-_client = None
-
-def get_client():
-    global _client
-    if _client is None:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY environment variable is not set")
-        _client = OpenAI(api_key=api_key)
-    return _client
-
-def generate_response(message: str, history: list[str], user_id: str = "default") -> str:
+
+async def _prepare_turn(message: str, history: list[str], user_id: str,
+                        session: ProfileSession = None, summary: str = ""):
     """
-    Generate a smart response using GPT-4o with user profile and conversation flow.
+    Run the profile-building flow and build the chat messages for one turn.
+
+    Returns (reply, messages, cache_key, decision): reply is set when the
+    answer is already known (next onboarding question or a cached response),
+    otherwise messages holds the prompt, decision is the model routing
+    decision and cache_key, if set, is where to store the generated answer.
     """
+    owns_session = session is None
+    if owns_session:
+        session = await run_blocking(ProfileSession, user_id)
+
     # Check if we need to continue profile building
-    if should_continue_profile_building(user_id):
+    building_profile = should_continue_profile_building(user_id, session=session)
+    if building_profile:
         # Process user response for profile building
-        flow_result = process_user_response(user_id, message)
+        flow_result = await process_user_response(user_id, message, session=session)
+        if owns_session:
+            await run_blocking(session.commit)
         
         if flow_result['next_question']:
-            return flow_result['next_question']
+            return flow_result['next_question'], None, None, None
         else:
             # Profile is complete, continue with normal conversation
             pass
     
-    # Get user profile summary
-    profile_summary = get_profile_summary(user_id)
-    
-    # Step 1: Retrieve semantic memory from RAG (optional)
-    try:
-        context = retrieve_context(message)
-    except Exception as e:
-        print(f"RAG context retrieval failed: {e}")
-        context = ""
-
-    # Step 2: Build prompt with RAG + profile + history
+    # Reuse the answer to a near-identical generic question (opt-in)
+    cache_key = None
+    if not building_profile:
+        cached, cache_key = await response_cache.lookup(message, session, history, summary)
+        if cached is not None:
+            return cached, None, None, None
+
+    # Step 1: Retrieve semantic memory from RAG (skipped when it can't help,
+    # bounded by a deadline)
+    context = await gated_context(message)
+
+    # Step 2: Build prompt with RAG + profile + history, fitted to the token budget
     system_prompt = "أنت مورفو، مساعد تسويقي ذكي. جاوب بإجابات قصيرة دقيقة وسياقية."
-    
-    if profile_summary:
-        system_prompt += f"\n\n{profile_summary}\nاستخدم هذه المعلومات لتقديم نصائح مخصصة."
-    
-    messages = [{"role": "system", "content": system_prompt}]
-    
-    if context:
-        messages.append({"role": "system", "content": context})
+    messages, _ = build_messages(
+        system_prompt,
+        message,
+        profile=session.summary(include_analysis=False),
+        analysis=session.analysis(),
+        context=context,
+        history=history,
+        summary=summary,
+        label=user_id,
+    )
 
-    for i, text in enumerate(history[-6:]):  # Keep last 3 user-bot pairs
-        role = "user" if i % 2 == 0 else "assistant"
-        messages.append({"role": role, "content": text})
+    # Step 3: Pick the model tier for this turn
+    decision = route(
+        'chat',
+        message,
+        stage=session.stage,
+        has_context=bool(context),
+        small_talk=should_retrieve(message)[1] == 'skipped_small_talk',
+    )
 
-    # Add current message
-    messages.append({"role": "user", "content": message})
+    return None, messages, cache_key, decision
 
-    # Step 3: Send to OpenAI
-    client = get_client()
-    response = client.chat.completions.create(
-        model=OPENAI_MODEL,
+async def generate_response(message: str, history: list[str], user_id: str = "default",
+                            session: ProfileSession = None, summary: str = "") -> str:
+    """
+    Generate a smart response using the routed model tier with user profile and conversation flow.
+
+    Pass the request's ProfileSession to reuse its snapshot; profile changes are
+    then left for the caller to commit. summary is the rolling summary of
+    turns older than history.
+    """
+    reply, messages, cache_key, decision = await _prepare_turn(message, history, user_id, session, summary)
+    if reply is not None:
+        return reply
+
+    # Step 4: Send to OpenAI (bounded by the request deadline, retried on
+    # transient errors; fast-tier calls are short enough to hedge)
+    started = time.perf_counter()
+    response = await chat_completion(
+        model=decision['model'],
         messages=messages,
         temperature=0.7,
+        hedge=decision['tier'] == 'fast',
     )
+    record_latency(decision, time.perf_counter() - started)
+
+    answer = response.choices[0].message.content.strip()
+    response_cache.store(cache_key, answer)
+    return answer
 
+async def stream_response(message: str, history: list[str], user_id: str = "default",
+                          session: ProfileSession = None, summary: str = ""):
+    """
+    Same as generate_response, but yields the answer as completion deltas
+    arrive instead of waiting for the full text.
+    """
+    reply, messages, cache_key, decision = await _prepare_turn(message, history, user_id, session, summary)
+    if reply is not None:
+        yield reply
+        return
+
+    started = time.perf_counter()
+    parts = []
+    async for delta in stream_completion(model=decision['model'], messages=messages, temperature=0.7):
+        parts.append(delta)
+        yield delta
+    record_latency(decision, time.perf_counter() - started)
+    # Only a fully streamed answer is cached
+    response_cache.store(cache_key, "".join(parts).strip())
+
+async def summarize_history(previous_summary: str, messages: list[str]) -> str:
+    """
+    Fold older user/bot messages into the running conversation summary.
+    Used by SessionMemory in the background, never on the request path.
+    """
+    transcript = "\n".join(
+        f"{'المستخدم' if i % 2 == 0 else 'مورفو'}: {text}" for i, text in enumerate(messages)
+    )
+    prompt = f"""الملخص الحالي للمحادثة:
+{previous_summary or 'لا يوجد'}
+
+رسائل جديدة:
+{transcript}
+
+حدّث الملخص ليشمل الرسائل الجديدة في أقل من 150 كلمة. احتفظ بالحقائق والقرارات وطلبات المستخدم وتفضيلاته، واحذف المجاملات."""
+
+    response = await chat_completion(
+        model=route('summary')['model'],
+        messages=[
+            {"role": "system", "content": "أنت تلخص محادثات مورفو، المساعد التسويقي، بإيجاز وباللغة العربية."},
+            {"role": "user", "content": prompt},
+        ],
+        temperature=0,
+        hedge=True,
+    )
     return response.choices[0].message.content.strip()
 
-def get_conversation_status(user_id: str) -> dict:
+def get_conversation_status(user_id: str, session: ProfileSession = None) -> dict:
     """
     Get current conversation status and next steps
     """
-    from user_profile import get_conversation_stage, is_profile_complete, get_user_profile
+    if session is None:
+        session = ProfileSession(user_id)
     
-    stage = get_conversation_stage(user_id)
-    profile_complete = is_profile_complete(user_id)
-    profile = get_user_profile(user_id)
+    profile_complete = session.is_complete()
     
     return {
-        'stage': stage,
+        'stage': session.stage,
         'profile_complete': profile_complete,
-        'profile': profile,
-        'next_question': get_next_question(user_id) if not profile_complete else None
+        'profile': session.profile,
+        'next_question': session.next_question() if not profile_complete else None
     }
 
 def get_next_question(user_id: str) -> str:
@@ -0,0 +1,350 @@
+# llm_provider.py
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from types import SimpleNamespace
+import httpx
+import openai
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+from request_context import remaining, current_user
+from admission import llm_admission
+
+load_dotenv()
+
+# "openai" (default) or "fake": a deterministic local stand-in for offline load tests
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai").lower()
+# Timeouts (seconds) shared by every model call
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+# Connection pool of the shared keep-alive HTTP client
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "50"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+# Retries after a rate limit, timeout, connection error or 5xx, with
+# exponential backoff and full jitter (seconds)
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+# Hedged calls fire a second request when the first is slower than the
+# model's p95 latency (at least LLM_HEDGE_MIN_DELAY seconds)
+LLM_HEDGING = os.getenv("LLM_HEDGING", "true").lower() in ("1", "true", "yes")
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1.5"))
+# Hedge delay used until a model has enough latency samples for a p95
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "4"))
+# Longest wait for the next streamed chunk
+LLM_STREAM_IDLE_TIMEOUT = float(os.getenv("LLM_STREAM_IDLE_TIMEOUT", "30"))
+LATENCY_SAMPLES = 200
+MIN_SAMPLES_FOR_P95 = 20
+
+# Fake backend: seconds before the first token, tokens per second after it,
+# and tokens per reply
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.3"))
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "50"))
+FAKE_LLM_REPLY_TOKENS = int(os.getenv("FAKE_LLM_REPLY_TOKENS", "60"))
+
+_client = None
+_http_client = None
+_lock = threading.Lock()
+_stats = Counter()
+_latencies = defaultdict(lambda: deque(maxlen=LATENCY_SAMPLES))  # model -> recent call seconds
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    asyncio.TimeoutError,
+)
+
+class LLMError(Exception):
+    """A model call that failed for good; user_message is safe to show to users."""
+
+    def __init__(self, code: str, user_message: str):
+        super().__init__(code)
+        self.code = code
+        self.user_message = user_message
+
+DEADLINE_MESSAGE = "عذراً، انتهت المهلة المخصصة لهذا الطلب. يرجى المحاولة مرة أخرى."
+
+def _friendly_error(error: Exception) -> LLMError:
+    if isinstance(error, LLMError):
+        return error
+    if remaining() == 0:
+        return LLMError('deadline', DEADLINE_MESSAGE)
+    if isinstance(error, openai.RateLimitError):
+        return LLMError('rate_limited', "عذراً، الخدمة مشغولة حالياً. يرجى المحاولة بعد قليل.")
+    if isinstance(error, (openai.APITimeoutError, asyncio.TimeoutError)):
+        return LLMError('timeout', "عذراً، استغرق توليد الرد وقتاً أطول من المتوقع. يرجى المحاولة مرة أخرى.")
+    if isinstance(error, openai.APIConnectionError):
+        return LLMError('connection', "عذراً، تعذّر الاتصال بخدمة الذكاء الاصطناعي. يرجى المحاولة بعد قليل.")
+    return LLMError('unavailable', "عذراً، حدث خطأ أثناء توليد الرد. يرجى المحاولة مرة أخرى.")
+
+def _openai_client():
+    global _http_client
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY environment variable is not set")
+    _http_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                            max_keepalive_connections=LLM_MAX_KEEPALIVE),
+    )
+    # Retries are handled by chat_completion, within the request deadline
+    return AsyncOpenAI(api_key=api_key, http_client=_http_client, max_retries=0)
+
+def get_client():
+    """
+    Return the process-wide chat client. Both backends expose the
+    AsyncOpenAI interface used here: client.chat.completions.create(...).
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = FakeLLM() if LLM_BACKEND == "fake" else _openai_client()
+    return _client
+
+def set_client(client):
+    """Install a different backend (e.g. a FakeLLM with custom timings)."""
+    global _client
+    with _lock:
+        _client = client
+
+async def aclose():
+    """Close the pooled HTTP connections; called on app shutdown."""
+    global _client, _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+    _client = _http_client = None
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    retry_after = None
+    response = getattr(error, 'response', None)
+    if response is not None:
+        try:
+            retry_after = float(response.headers.get('retry-after'))
+        except (TypeError, ValueError):
+            pass
+    delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+    return max(delay, retry_after or 0.0)
+
+def _hedge_delay_locked(samples) -> float:
+    samples = sorted(samples)
+    if len(samples) < MIN_SAMPLES_FOR_P95:
+        return max(LLM_HEDGE_MIN_DELAY, LLM_HEDGE_DEFAULT_DELAY)
+    return max(LLM_HEDGE_MIN_DELAY, samples[int(0.95 * (len(samples) - 1))])
+
+def _hedge_delay(model: str) -> float:
+    with _lock:
+        return _hedge_delay_locked(_latencies[model])
+
+def _attempt_timeout() -> float:
+    left = remaining()
+    if left is not None and left <= 0:
+        raise LLMError('deadline', DEADLINE_MESSAGE)
+    return LLM_TIMEOUT if left is None else min(LLM_TIMEOUT, left)
+
+async def _create(kwargs: dict):
+    timeout = _attempt_timeout()
+    return await asyncio.wait_for(get_client().chat.completions.create(timeout=timeout, **kwargs), timeout)
+
+async def _single_call(kwargs: dict, admitted: bool = False):
+    started = time.perf_counter()
+    if admitted:
+        response = await _create(kwargs)
+    else:
+        async with llm_admission.slot(current_user()):
+            response = await _create(kwargs)
+    if not kwargs.get('stream'):
+        # Stream openings return at the first byte; only full calls feed the p95
+        with _lock:
+            _latencies[kwargs.get('model')].append(time.perf_counter() - started)
+    return response
+
+async def _hedged_call(kwargs: dict):
+    """
+    Fire a second identical request if the first is slow; the first answer
+    wins. Whatever is still running when this returns, fails or is cancelled
+    is cancelled with it.
+    """
+    tasks = [asyncio.ensure_future(_single_call(kwargs))]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=_hedge_delay(kwargs.get('model')))
+        if done:
+            return tasks[0].result()
+        # The hedge only uses spare capacity; it never queues behind other users
+        if not llm_admission.try_acquire():
+            return await tasks[0]
+        _count('hedged')
+
+        async def hedge_call():
+            try:
+                return await _single_call(kwargs, admitted=True)
+            finally:
+                llm_admission.release()
+
+        tasks.append(asyncio.ensure_future(hedge_call()))
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is tasks[1]:
+                        _count('hedge_wins')
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+async def chat_completion(hedge: bool = False, admitted: bool = False, **kwargs):
+    """
+    client.chat.completions.create(**kwargs) within the request deadline,
+    retrying transient failures with jittered exponential backoff. Set hedge
+    for short idempotent calls. Each attempt takes a slot from the admission
+    controller unless the caller already holds one (admitted). Raises
+    LLMError when it gives up, or admission.Overloaded when there is no
+    capacity.
+    """
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        _count('attempts')
+        try:
+            if hedge and LLM_HEDGING and not admitted:
+                return await _hedged_call(kwargs)
+            return await _single_call(kwargs, admitted)
+        except RETRYABLE_ERRORS as e:
+            delay = _retry_delay(e, attempt)
+            left = remaining()
+            if attempt == LLM_MAX_RETRIES or (left is not None and delay >= left):
+                _count('failed')
+                print(f"LLM call failed after {attempt + 1} attempt(s): {e!r}")
+                raise _friendly_error(e) from e
+            _count('retries')
+            print(f"LLM call failed ({type(e).__name__}); retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+        except LLMError:
+            _count('deadline_exceeded')
+            raise
+        except openai.OpenAIError as e:
+            _count('failed')
+            print(f"LLM call failed: {e!r}")
+            raise _friendly_error(e) from e
+
+async def stream_completion(**kwargs):
+    """
+    Streamed chat completion: yields content deltas. Opening the stream is
+    retried like chat_completion; once text has been sent, a stalled or
+    failed stream raises LLMError instead of starting over.
+    """
+    # The slot is held for the whole stream, not just while it opens
+    await llm_admission.acquire(current_user())
+    try:
+        stream = await chat_completion(stream=True, admitted=True, **kwargs)
+    except BaseException:
+        llm_admission.release()
+        raise
+    iterator = stream.__aiter__()
+    try:
+        while True:
+            left = remaining()
+            if left is not None and left <= 0:
+                _count('deadline_exceeded')
+                raise LLMError('deadline', DEADLINE_MESSAGE)
+            idle = LLM_STREAM_IDLE_TIMEOUT if left is None else min(LLM_STREAM_IDLE_TIMEOUT, left)
+            try:
+                chunk = await asyncio.wait_for(iterator.__anext__(), idle)
+            except StopAsyncIteration:
+                return
+            except (asyncio.TimeoutError, openai.OpenAIError) as e:
+                _count('failed')
+                print(f"LLM stream interrupted: {e!r}")
+                raise _friendly_error(e) from e
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        # Release the connection even if the caller stops early
+        llm_admission.release()
+        close = getattr(stream, 'close', None) or getattr(stream, 'aclose', None)
+        if close is not None:
+            await close()
+
+def _count(key: str):
+    with _lock:
+        _stats[key] += 1
+
+def get_llm_stats() -> dict:
+    with _lock:
+        return {
+            **_stats,
+            'hedge_delays': {model: round(_hedge_delay_locked(samples), 3) for model, samples in _latencies.items()},
+        }
+
+def get_embedding_model(model: str):
+    """Embedding backend matching LLM_BACKEND (fake vectors need no network)."""
+    if LLM_BACKEND == "fake":
+        from langchain_community.embeddings import DeterministicFakeEmbedding
+        return DeterministicFakeEmbedding(size=1536)
+    from langchain_community.embeddings import OpenAIEmbeddings
+    return OpenAIEmbeddings(model=model, openai_api_key=os.getenv("OPENAI_API_KEY"))
+
+class FakeLLM:
+    """
+    Deterministic stand-in for the chat completions API. The reply depends
+    only on the model and messages; timing follows the configured latency and
+    token rate, with or without stream=True.
+    """
+
+    def __init__(self, latency: float = FAKE_LLM_LATENCY, tokens_per_second: float = FAKE_LLM_TOKENS_PER_SECOND,
+                 reply_tokens: int = FAKE_LLM_REPLY_TOKENS):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _reply_tokens(self, model: str, messages: list, response_format=None) -> list[str]:
+        digest = hashlib.sha256(
+            json.dumps([model, messages], ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        if response_format and response_format.get("type") == "json_object":
+            return [json.dumps({
+                "industry": "تجزئة", "offering": f"منتجات {digest[:6]}", "audience": "عملاء عامون",
+                "weaknesses": ["ضعف الظهور في محركات البحث"], "keywords": ["تسويق", digest[:6]],
+            }, ensure_ascii=False)]
+        words = ["هذا", "رد", "تجريبي", f"({digest[:8]})", "من", "مورفو", "لاختبار", "الأداء", "دون", "اتصال."]
+        return [words[i % len(words)] + " " for i in range(self.reply_tokens)]
+
+    async def create(self, model: str, messages: list, stream: bool = False, response_format=None, **kwargs):
+        self.calls += 1
+        tokens = self._reply_tokens(model, messages, response_format)
+        await asyncio.sleep(self.latency)
+        if stream:
+            return self._stream(model, tokens)
+        if self.tokens_per_second > 0:
+            await asyncio.sleep(len(tokens) / self.tokens_per_second)
+        return SimpleNamespace(
+            id=f"fake-{self.calls}",
+            model=model,
+            created=int(time.time()),
+            choices=[SimpleNamespace(index=0, finish_reason="stop",
+                                     message=SimpleNamespace(role="assistant", content="".join(tokens)))],
+            usage=SimpleNamespace(prompt_tokens=0, completion_tokens=len(tokens), total_tokens=len(tokens)),
+        )
+
+    async def _stream(self, model: str, tokens: list[str]):
+        for token in tokens:
+            if self.tokens_per_second > 0:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            yield SimpleNamespace(
+                model=model,
+                choices=[SimpleNamespace(index=0, finish_reason=None,
+                                         delta=SimpleNamespace(role="assistant", content=token))],
+            )
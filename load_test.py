@@ -0,0 +1,141 @@
+# load_test.py
+"""
+Offline load test: serves the app locally with the fake LLM backend and
+drives /chat (or /chat/stream) with concurrent users. No network access or
+API key is needed; profiles and caches go to a temporary directory.
+
+    python load_test.py --users 50 --requests 5 --stream
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+_workdir = tempfile.mkdtemp(prefix="morvo-load-")
+os.environ["LLM_BACKEND"] = "fake"
+os.environ.setdefault("OPENAI_API_KEY", "offline")
+os.environ.setdefault("DB_FILE", os.path.join(_workdir, "user_profiles.db"))
+os.environ.setdefault("EMBEDDING_CACHE_DB", os.path.join(_workdir, "embedding_cache.db"))
+os.environ.setdefault("PAGE_CACHE_DB", os.path.join(_workdir, "page_cache.db"))
+os.environ.setdefault("REPORT_CACHE_DB", os.path.join(_workdir, "report_cache.db"))
+os.environ.setdefault("CHROMA_DIR", os.path.join(_workdir, "chroma_db"))
+
+import httpx
+import uvicorn
+import main
+from user_profile import ProfileSession
+
+# The Streamlit quick actions plus a few common questions
+QUESTIONS = [
+    "أعطني نصائح تسويقية مفيدة",
+    "ساعدني في تحليل السوق",
+    "ما هي أفضل استراتيجية تسويقية؟",
+    "كيف أكتب منشوراً جذاباً على إنستغرام؟",
+    "ما الميزانية المناسبة لحملة إعلانية على جوجل؟",
+    "كيف أقيس نجاح حملة البريد الإلكتروني؟",
+]
+
+def _seed_users(count: int) -> list[str]:
+    """Create users with complete profiles so every turn reaches the model."""
+    user_ids = []
+    for i in range(count):
+        user_id = f"load_{i}"
+        session = ProfileSession(user_id)
+        session.update(name=f"مستخدم{i}", business_type="مدير تسويق", goals="زيادة المبيعات",
+                       website_url="https://example.com", conversation_stage='complete')
+        session.commit()
+        user_ids.append(user_id)
+    return user_ids
+
+async def _chat(http, user_id: str, message: str, stream: bool):
+    """Returns (total seconds, seconds to first byte of the answer, outcome)."""
+    started = time.perf_counter()
+    first = None
+    payload = {"user_id": user_id, "message": message}
+    try:
+        if stream:
+            async with http.stream("POST", "/chat/stream", json=payload) as response:
+                outcome = 'ok' if response.status_code == 200 else 'failed'
+                event = None
+                async for line in response.aiter_lines():
+                    if first is None and line.startswith("event: delta"):
+                        first = time.perf_counter() - started
+                    if line.startswith("event: "):
+                        event = line[len("event: "):]
+                    elif event == "error" and line.startswith("data: "):
+                        outcome = 'busy' if '"busy"' in line else 'failed'
+        else:
+            response = await http.post("/chat", json=payload)
+            outcome = {200: 'ok', 429: 'busy'}.get(response.status_code, 'failed')
+    except httpx.HTTPError:
+        outcome = 'failed'
+    total = time.perf_counter() - started
+    return total, first if first is not None else total, outcome
+
+async def _user(http, user_id: str, requests: int, stream: bool, results: list):
+    offset = int(user_id.rsplit("_", 1)[1])
+    for i in range(requests):
+        question = QUESTIONS[(offset + i) % len(QUESTIONS)]
+        results.append(await _chat(http, user_id, question, stream))
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+async def run(users: int, requests: int, stream: bool, port: int, verbose: bool):
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    user_ids = _seed_users(users)
+    results = []
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120, limits=limits) as http:
+        output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        started = time.perf_counter()
+        with output:
+            await asyncio.gather(*(_user(http, user_id, requests, stream, results) for user_id in user_ids))
+        elapsed = time.perf_counter() - started
+        metrics = (await http.get("/metrics")).json()
+
+    server.should_exit = True
+    await server_task
+
+    totals = [total for total, _, outcome in results if outcome == 'ok']
+    firsts = [first for _, first, outcome in results if outcome == 'ok']
+    busy = [total for total, _, outcome in results if outcome == 'busy']
+    failed = sum(1 for _, _, outcome in results if outcome == 'failed')
+    print(f"endpoint: {'/chat/stream' if stream else '/chat'}  users: {users}  requests/user: {requests}")
+    print(f"completed: {len(totals)}  busy (429): {len(busy)}  failed: {failed}  wall time: {elapsed:.2f}s  "
+          f"throughput: {len(totals) / elapsed:.1f} req/s")
+    if totals:
+        print(f"latency   p50={_percentile(totals, 50):.3f}s p95={_percentile(totals, 95):.3f}s "
+              f"p99={_percentile(totals, 99):.3f}s mean={statistics.mean(totals):.3f}s")
+    if stream and firsts:
+        print(f"first token p50={_percentile(firsts, 50):.3f}s p95={_percentile(firsts, 95):.3f}s")
+    if busy:
+        print(f"busy responses p50={_percentile(busy, 50):.3f}s (rejected without waiting for a timeout)")
+    print(f"routing: {metrics.get('model_routing', {}).get('decisions')}")
+    print(f"admission: {metrics.get('admission', {}).get('llm')}")
+    print(f"response cache: {metrics.get('response_cache')}")
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Offline load test with the fake LLM backend")
+    parser.add_argument("--users", type=int, default=20, help="concurrent users")
+    parser.add_argument("--requests", type=int, default=5, help="sequential requests per user")
+    parser.add_argument("--stream", action="store_true", help="use /chat/stream instead of /chat")
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--verbose", action="store_true", help="show the app's own log lines")
+    args = parser.parse_args()
+    print(f"Fake backend: latency={os.getenv('FAKE_LLM_LATENCY', '0.3')}s "
+          f"rate={os.getenv('FAKE_LLM_TOKENS_PER_SECOND', '50')} tok/s  workdir={_workdir}", file=sys.stderr)
+    asyncio.run(run(args.users, args.requests, args.stream, args.port, args.verbose))
+
+if __name__ == "__main__":
+    main_cli()
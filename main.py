@@ -1,14 +1,28 @@
 # main.py
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse
 from dotenv import load_dotenv
 import os
 from pydantic import BaseModel
-from llm import generate_response, get_conversation_status
+from llm import generate_response, stream_response, get_conversation_status, summarize_history
 from session_memory import SessionMemory
 from db_logger import log_chat
-from website_analyzer import analyze_website, generate_analysis_report
-from user_profile import get_user_profile, is_profile_complete
+from chroma_memory import get_vectordb, get_embedding_cache_stats
+from retrieval_gate import get_retrieval_stats
+from response_cache import get_response_cache_stats
+from model_router import get_routing_stats
+from website_analyzer import generate_analysis_report
+from site_crawler import crawl_site, get_crawler_stats
+from page_cache import get_page_cache_stats
+from http_fetcher import aclose as close_http_fetcher, get_fetcher_stats
+from report_cache import get_report_cache_stats
+from user_profile import ProfileSession, get_profile_cache_stats, update_conversation_stage
+from thread_pool import run_blocking, shutdown as shutdown_thread_pool
+from llm_provider import aclose as close_llm_provider, get_llm_stats, LLMError
+from request_context import request_deadline, set_current_user
+from admission import Overloaded, get_admission_stats
+import json
 import re
 
 load_dotenv()
@@ -22,7 +36,42 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-memory = SessionMemory()
+memory = SessionMemory(summarizer=summarize_history)
+
+# Every request gets a deadline; LLM calls and page fetches stop retrying or
+# waiting once it has passed
+@app.middleware("http")
+async def apply_request_deadline(request, call_next):
+    with request_deadline():
+        return await call_next(request)
+
+# Out of model capacity: tell the client to come back instead of timing out
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(exc.retry_after)},
+        content={
+            "response": _busy_message(exc.retry_after),
+            "error": "busy",
+            "retry_after": exc.retry_after
+        }
+    )
+
+def _busy_message(retry_after: int) -> str:
+    return f"مورفو مشغول حالياً بسبب كثرة الطلبات. يرجى المحاولة بعد {retry_after} ثانية."
+
+@app.on_event("startup")
+async def on_startup():
+    # Open the vector store once, before the first chat needs it
+    await run_blocking(get_vectordb)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    memory.shutdown()
+    await close_llm_provider()
+    await close_http_fetcher()
+    shutdown_thread_pool()
 
 # Request schemas
 class ChatInput(BaseModel):
@@ -48,90 +97,211 @@ async def greet():
 # GET /profile/{user_id} - Get user profile status
 @app.get("/profile/{user_id}")
 async def get_profile(user_id: str):
-    profile = get_user_profile(user_id)
-    status = get_conversation_status(user_id)
+    session = await run_blocking(ProfileSession, user_id)
+    status = get_conversation_status(user_id, session=session)
     
     return {
         "user_id": user_id,
-        "profile": profile,
+        "profile": session.profile,
         "conversation_status": status
     }
 
-# POST /chat endpoint with conversation flow
-@app.post("/chat")
-async def chat(input: ChatInput):
-    history = memory.get_history(input.user_id)
-    
-    # Get current conversation status
-    status = get_conversation_status(input.user_id)
-    current_stage = status.get('stage', 'greeting')
-    
+# GET /metrics - In-process cache and pipeline counters
+@app.get("/metrics")
+async def metrics():
+    return {
+        "profile_cache": get_profile_cache_stats(),
+        "embedding_cache": get_embedding_cache_stats(),
+        "page_cache": get_page_cache_stats(),
+        "fetcher": get_fetcher_stats(),
+        "crawler": get_crawler_stats(),
+        "report_cache": get_report_cache_stats(),
+        "retrieval": get_retrieval_stats(),
+        "response_cache": get_response_cache_stats(),
+        "model_routing": get_routing_stats(),
+        "llm": get_llm_stats(),
+        "admission": get_admission_stats()
+    }
+
+def _name_stage_error(stage: str, message: str) -> dict:
+    """Reject URLs while we are still asking for the user's name."""
     # Special handling for name input stage
-    if current_stage in ['greeting', 'name']:
+    if stage in ['greeting', 'name']:
         # Check for URLs or invalid input
         url_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-        if re.search(url_pattern, input.message):
-            response = "عذراً، يبدو أنك أدخلت رابطاً. في هذه المرحلة، أحتاج فقط إلى اسمك. هل يمكنك إخباري باسمك؟"
+        if re.search(url_pattern, message):
             return {
-                "response": response,
-                "history": memory.get_history(input.user_id),
-                "conversation_status": status,
-                "profile_complete": False,
+                "response": "عذراً، يبدو أنك أدخلت رابطاً. في هذه المرحلة، أحتاج فقط إلى اسمك. هل يمكنك إخباري باسمك؟",
                 "error": "invalid_name"
             }
-    
-    # If the message contains a URL and profile is complete, run website analysis
-    url_match = re.search(r"https?://[^\s]+", input.message.strip())
-    if url_match and is_profile_complete(input.user_id):
-        try:
-            user_profile = get_user_profile(input.user_id)
-            url = url_match.group(0)
-            website_data = analyze_website(url)
-            analysis_report = generate_analysis_report(website_data, user_profile)
-            response = analysis_report
-        except Exception as e:
-            response = f"عذراً، حدث خطأ أثناء تحليل الموقع: {str(e)}"
-    else:
-        # Generate response with user profile context
-        response = generate_response(input.message, history, input.user_id)
+    return None
+
+def _analysis_url(message: str, session: ProfileSession) -> str:
+    """Return the URL to analyze if the message contains one and the profile is complete."""
+    url_match = re.search(r"https?://[^\s]+", message.strip())
+    if url_match and session.is_complete():
+        return url_match.group(0)
+    return None
+
+async def _analyze_url_for_chat(url: str, session: ProfileSession) -> str:
+    try:
+        website_data = await crawl_site(url)
+        return await generate_analysis_report(website_data, session.profile)
+    except (Overloaded, LLMError):
+        raise  # answered with 429 / the friendly model error, not stored as a turn
+    except Exception as e:
+        return f"عذراً، حدث خطأ أثناء تحليل الموقع: {str(e)}"
+
+async def _finish_turn(input: ChatInput, session: ProfileSession, response: str) -> dict:
+    """Persist a completed turn and build the response payload."""
+    # Write back any profile changes in a single statement
+    await run_blocking(session.commit)
     
     # Store in memory
     memory.append(input.user_id, input.message, response)
     
     # Log the interaction
-    log_chat(input.user_id, input.message, response)
+    await run_blocking(log_chat, input.user_id, input.message, response)
     
     # Get conversation status
-    status = get_conversation_status(input.user_id)
+    status = get_conversation_status(input.user_id, session=session)
     
     return {
         "response": response,
         "history": memory.get_history(input.user_id),
         "conversation_status": status,
-        "profile_complete": is_profile_complete(input.user_id)
+        "profile_complete": session.is_complete()
     }
 
+# POST /chat endpoint with conversation flow
+@app.post("/chat")
+async def chat(input: ChatInput):
+    set_current_user(input.user_id)
+    history = memory.get_history(input.user_id)
+    
+    # Load the profile once for the whole request
+    session = await run_blocking(ProfileSession, input.user_id)
+    
+    # Get current conversation status
+    status = get_conversation_status(input.user_id, session=session)
+    
+    name_error = _name_stage_error(status.get('stage', 'greeting'), input.message)
+    if name_error:
+        return {
+            "response": name_error["response"],
+            "history": memory.get_history(input.user_id),
+            "conversation_status": status,
+            "profile_complete": False,
+            "error": name_error["error"]
+        }
+    
+    # If the message contains a URL and profile is complete, run website analysis
+    url = _analysis_url(input.message, session)
+    try:
+        if url:
+            response = await _analyze_url_for_chat(url, session)
+        else:
+            # Generate response with user profile context
+            response = await generate_response(input.message, history, input.user_id, session=session,
+                                               summary=memory.get_summary(input.user_id))
+    except LLMError as e:
+        # Keep profile progress, but don't store the apology as a turn
+        await run_blocking(session.commit)
+        return {
+            "response": e.user_message,
+            "history": memory.get_history(input.user_id),
+            "conversation_status": get_conversation_status(input.user_id, session=session),
+            "profile_complete": session.is_complete(),
+            "error": e.code
+        }
+    
+    return await _finish_turn(input, session, response)
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# POST /chat/stream - Same as /chat, streamed as Server-Sent Events.
+# Emits "delta" events ({"text": ...}) while the answer is generated, then a
+# single "done" event carrying the /chat payload (or an "error" event).
+@app.post("/chat/stream")
+async def chat_stream(input: ChatInput):
+    set_current_user(input.user_id)
+    history = memory.get_history(input.user_id)
+    session = await run_blocking(ProfileSession, input.user_id)
+    status = get_conversation_status(input.user_id, session=session)
+    
+    async def events():
+        name_error = _name_stage_error(status.get('stage', 'greeting'), input.message)
+        if name_error:
+            yield _sse("delta", {"text": name_error["response"]})
+            yield _sse("done", {
+                "response": name_error["response"],
+                "history": memory.get_history(input.user_id),
+                "conversation_status": status,
+                "profile_complete": False,
+                "error": name_error["error"]
+            })
+            return
+        
+        parts = []
+        try:
+            url = _analysis_url(input.message, session)
+            if url:
+                report = await _analyze_url_for_chat(url, session)
+                parts.append(report)
+                yield _sse("delta", {"text": report})
+            else:
+                async for delta in stream_response(input.message, history, input.user_id, session=session,
+                                                   summary=memory.get_summary(input.user_id)):
+                    parts.append(delta)
+                    yield _sse("delta", {"text": delta})
+        except LLMError as e:
+            await run_blocking(session.commit)
+            yield _sse("error", {"error": e.user_message, "code": e.code})
+            return
+        except Overloaded as e:
+            # Nothing is saved, so the same message can simply be resent
+            yield _sse("error", {"error": _busy_message(e.retry_after), "code": "busy", "retry_after": e.retry_after})
+            return
+        except Exception as e:
+            print(f"Streaming chat failed: {e}")
+            yield _sse("error", {"error": "عذراً، حدث خطأ أثناء توليد الرد. يرجى المحاولة مرة أخرى."})
+            return
+        
+        # Persist only once the full answer has been streamed
+        payload = await _finish_turn(input, session, "".join(parts).strip())
+        yield _sse("done", payload)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # POST /analyze-website endpoint
 @app.post("/analyze-website")
 async def analyze_website_endpoint(input: WebsiteAnalysisInput):
+    set_current_user(input.user_id)
+    session = await run_blocking(ProfileSession, input.user_id)
+    
     # Check if profile is complete
-    if not is_profile_complete(input.user_id):
+    if not session.is_complete():
         return {
             "error": "يرجى إكمال ملفك الشخصي أولاً",
             "message": "دعني أتعرف عليك أكثر قبل تحليل المواقع"
         }
     
     # Get user profile for personalized analysis
-    user_profile = get_user_profile(input.user_id)
+    user_profile = session.profile
     
-    # Analyze the website
-    website_data = analyze_website(input.url)
+    # Analyze the website and its key inner pages
+    website_data = await crawl_site(input.url)
     
     # Generate smart analysis report with user profile
-    analysis_report = generate_analysis_report(website_data, user_profile)
+    analysis_report = await generate_analysis_report(website_data, user_profile)
     
     # Log the interaction
-    log_chat(input.user_id, f"تحليل موقع: {input.url}", analysis_report)
+    await run_blocking(log_chat, input.user_id, f"تحليل موقع: {input.url}", analysis_report)
     
     return {
         "website_data": website_data,
@@ -143,8 +313,7 @@ async def analyze_website_endpoint(input: WebsiteAnalysisInput):
 # POST /reset-profile - Reset user profile
 @app.post("/reset-profile/{user_id}")
 async def reset_profile(user_id: str):
-    from user_profile import update_conversation_stage
-    update_conversation_stage(user_id, 'greeting')
+    await run_blocking(update_conversation_stage, user_id, 'greeting')
     memory.clear(user_id)
     
     return {
@@ -0,0 +1,121 @@
+# model_router.py
+import os
+import threading
+import time
+from collections import Counter, deque
+
+# Model tiers, fastest first. The latency is the expected time (seconds) for
+# a full answer until real measurements replace it.
+TIER_ORDER = ['fast', 'standard', 'heavy']
+TIER_DEFAULTS = {
+    'fast': ("gpt-4o-mini", 2.0),
+    'standard': ("gpt-4o", 5.0),
+    'heavy': ("gpt-4", 15.0),
+}
+
+# Latency budgets (seconds) for a chat answer and for a website analysis report
+CHAT_LATENCY_BUDGET = float(os.getenv("CHAT_LATENCY_BUDGET", "8"))
+ANALYSIS_LATENCY_BUDGET = float(os.getenv("ANALYSIS_LATENCY_BUDGET", "60"))
+# Messages up to this many characters with no RAG context go to the fast tier
+ROUTER_SHORT_MESSAGE_CHARS = int(os.getenv("ROUTER_SHORT_MESSAGE_CHARS", "80"))
+# Weight of each new latency measurement in the running average
+LATENCY_SMOOTHING = 0.2
+RECENT_DECISIONS = 50
+
+class ModelTier:
+    def __init__(self, name: str, model: str, latency: float):
+        self.name = name
+        self.model = model
+        self.baseline = latency
+        self.latency = latency  # running average of observed latency
+
+def _load_tiers() -> dict:
+    tiers = {}
+    for name in TIER_ORDER:
+        model, latency = TIER_DEFAULTS[name]
+        tiers[name] = ModelTier(
+            name,
+            os.getenv(f"MODEL_TIER_{name.upper()}", model),
+            float(os.getenv(f"MODEL_TIER_{name.upper()}_LATENCY", str(latency))),
+        )
+    return tiers
+
+TIERS = _load_tiers()
+
+_lock = threading.Lock()
+_counts = Counter()
+_recent = deque(maxlen=RECENT_DECISIONS)
+
+def _preferred_tier(task: str, message: str, stage: str, has_context: bool, small_talk: bool):
+    """Tier the request would get with no latency limit, and why."""
+    if task == 'analysis':
+        return 'heavy', 'analysis_report'
+    if task in ('digest', 'summary'):
+        return 'fast', 'background_' + task
+    if small_talk:
+        return 'fast', 'small_talk'
+    if stage != 'complete':
+        return 'fast', 'onboarding'
+    if not has_context and len(message.strip()) <= ROUTER_SHORT_MESSAGE_CHARS:
+        return 'fast', 'short_message'
+    if has_context:
+        return 'standard', 'rag_context'
+    return 'standard', 'long_message'
+
+def route(task: str = 'chat', message: str = "", stage: str = 'complete', has_context: bool = False,
+          small_talk: bool = False, latency_budget: float = None) -> dict:
+    """
+    Pick a model for one request and record the decision.
+
+    Chat answers go to the fast tier for small talk, onboarding and short
+    questions without RAG context, otherwise to the standard tier; analysis
+    reports go to the heavy tier. If the chosen tier's expected latency is
+    over the budget, the next faster tier is used instead.
+    """
+    if latency_budget is None:
+        latency_budget = ANALYSIS_LATENCY_BUDGET if task == 'analysis' else CHAT_LATENCY_BUDGET
+    tier_name, reason = _preferred_tier(task, message, stage, has_context, small_talk)
+    index = TIER_ORDER.index(tier_name)
+    with _lock:
+        while index > 0 and TIERS[TIER_ORDER[index]].latency > latency_budget:
+            # A skipped tier drifts back to its configured latency, so one slow
+            # spell does not rule it out for good
+            skipped = TIERS[TIER_ORDER[index]]
+            skipped.latency += LATENCY_SMOOTHING * (skipped.baseline - skipped.latency)
+            index -= 1
+    if TIER_ORDER[index] != tier_name:
+        reason += '+latency_budget'
+    tier = TIERS[TIER_ORDER[index]]
+
+    decision = {
+        'task': task,
+        'tier': tier.name,
+        'model': tier.model,
+        'reason': reason,
+        'latency_budget': latency_budget,
+        'at': time.time(),
+    }
+    with _lock:
+        _counts[f"{task}:{tier.name}"] += 1
+        _recent.append(decision)
+    return decision
+
+def record_latency(decision: dict, seconds: float):
+    """Feed a measured call latency back into the tier's running average."""
+    tier = TIERS.get(decision.get('tier'))
+    if tier is None:
+        return
+    with _lock:
+        tier.latency += LATENCY_SMOOTHING * (seconds - tier.latency)
+    decision['seconds'] = round(seconds, 3)
+
+def get_routing_stats() -> dict:
+    with _lock:
+        return {
+            'tiers': {
+                name: {'model': TIERS[name].model, 'latency': round(TIERS[name].latency, 3)}
+                for name in TIER_ORDER
+            },
+            'decisions': dict(_counts),
+            'recent': list(_recent),
+        }
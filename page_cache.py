@@ -0,0 +1,192 @@
+# page_cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+PAGE_CACHE_DB = os.getenv("PAGE_CACHE_DB", "page_cache.db")
+# Seconds a fetched page is used without asking the site again
+PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", "21600"))
+# Per-domain overrides, e.g. "news.example.com=600,example.sa=86400"
+PAGE_CACHE_DOMAIN_TTLS = os.getenv("PAGE_CACHE_DOMAIN_TTLS", "")
+# Total size (bytes, compressed) of stored pages; least recently used go first
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+# Pages read only in part (early stop, byte cap, time budget) are kept this
+# many seconds at most and never revalidated, since their validators describe the full page
+PAGE_CACHE_PARTIAL_TTL = int(os.getenv("PAGE_CACHE_PARTIAL_TTL", "600"))
+
+def _parse_domain_ttls(spec: str) -> dict:
+    ttls = {}
+    for item in spec.split(','):
+        domain, _, seconds = item.partition('=')
+        if domain.strip() and seconds.strip().isdigit():
+            ttls[domain.strip().lower()] = int(seconds)
+    return ttls
+
+DOMAIN_TTLS = _parse_domain_ttls(PAGE_CACHE_DOMAIN_TTLS)
+
+def normalize_url(url: str) -> str:
+    """
+    Canonical form used for cache keys: lower-case scheme and host, no
+    default port, no fragment, sorted query, and "/" for an empty path.
+    """
+    parts = urlsplit(url.strip())
+    scheme = (parts.scheme or 'https').lower()
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    if parts.port and (scheme, parts.port) not in (('http', 80), ('https', 443)):
+        host = f"{host}:{parts.port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+def ttl_for(domain: str) -> int:
+    """TTL for a domain: the most specific override (domain or a parent), else the default."""
+    domain = domain.lower().split(':')[0]
+    if domain.startswith('www.'):
+        domain = domain[4:]
+    labels = domain.split('.')
+    for i in range(len(labels)):
+        ttl = DOMAIN_TTLS.get('.'.join(labels[i:]))
+        if ttl is not None:
+            return ttl
+    return PAGE_CACHE_TTL
+
+def _key(url: str) -> str:
+    return hashlib.sha256(normalize_url(url).encode("utf-8")).hexdigest()
+
+class PageCache:
+    """
+    On-disk cache of fetched pages in SQLite, keyed by normalized URL. Bodies
+    are stored zlib-compressed together with the validators (ETag,
+    Last-Modified) needed to revalidate a stale page with a conditional GET.
+    Partial bodies are stored without validators and with a short TTL.
+    """
+
+    def __init__(self, path: str = PAGE_CACHE_DB, max_bytes: int = PAGE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'stale': 0, 'revalidated': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                key TEXT PRIMARY KEY,
+                url TEXT,
+                domain TEXT,
+                body BLOB,
+                size INTEGER,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL,
+                accessed_at REAL,
+                complete INTEGER DEFAULT 1
+            )
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(pages)")}
+        if 'complete' not in columns:
+            self._conn.execute("ALTER TABLE pages ADD COLUMN complete INTEGER DEFAULT 1")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed_at)")
+        self._conn.commit()
+
+    def get(self, url: str):
+        """
+        The cached page as a dict (url, body, etag, last_modified, fresh,
+        complete), or None. A stale entry is still returned so its validators
+        can be sent.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url, domain, body, etag, last_modified, fetched_at, complete FROM pages WHERE key = ?",
+                (_key(url),)
+            ).fetchone()
+            if row is None:
+                self._stats['misses'] += 1
+                return None
+            cached_url, domain, body, etag, last_modified, fetched_at, complete = row
+            ttl = ttl_for(domain) if complete else min(ttl_for(domain), PAGE_CACHE_PARTIAL_TTL)
+            fresh = now - fetched_at < ttl
+            if fresh:
+                self._stats['hits'] += 1
+                self._conn.execute("UPDATE pages SET accessed_at = ? WHERE key = ?", (now, _key(url)))
+                self._conn.commit()
+            else:
+                self._stats['stale'] += 1
+        return {
+            'url': cached_url,
+            'body': zlib.decompress(body).decode('utf-8'),
+            'etag': etag,
+            'last_modified': last_modified,
+            'fresh': fresh,
+            'complete': bool(complete),
+        }
+
+    def put(self, url: str, body: str, etag: str = None, last_modified: str = None, complete: bool = True):
+        if not complete:
+            etag = last_modified = None
+        body_blob = zlib.compress(body.encode('utf-8'), 6)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages "
+                "(key, url, domain, body, size, etag, last_modified, fetched_at, accessed_at, complete) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (_key(url), url, urlsplit(normalize_url(url)).netloc, body_blob, len(body_blob),
+                 etag, last_modified, now, now, int(complete))
+            )
+            self._stats['stores'] += 1
+            self._evict()
+            self._conn.commit()
+
+    def refresh(self, url: str, etag: str = None, last_modified: str = None):
+        """Mark a stale page fresh again after the site answered 304 Not Modified."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE pages SET fetched_at = ?, accessed_at = ?, "
+                "etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified) WHERE key = ?",
+                (now, now, etag, last_modified, _key(url))
+            )
+            self._conn.commit()
+            self._stats['revalidated'] += 1
+
+    def _evict(self):
+        """Drop least recently used pages until the total size fits. Caller holds the lock."""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM pages ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM pages WHERE key = ?", (key,))
+            total -= size
+            self._stats['evictions'] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages").fetchone()
+            lookups = self._stats['hits'] + self._stats['stale'] + self._stats['misses']
+            return {
+                **self._stats,
+                'entries': entries,
+                'bytes': size,
+                'max_bytes': self.max_bytes,
+                'hit_rate': self._stats['hits'] / lookups if lookups else 0.0,
+            }
+
+def conditional_headers(cached: dict) -> dict:
+    """If-None-Match / If-Modified-Since headers for revalidating a cached page."""
+    headers = {}
+    if cached and cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+    if cached and cached.get('last_modified'):
+        headers['If-Modified-Since'] = cached['last_modified']
+    return headers
+
+page_cache = PageCache()
+
+def get_page_cache_stats() -> dict:
+    return page_cache.stats()
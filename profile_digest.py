@@ -0,0 +1,73 @@
+# profile_digest.py
+import json
+from dotenv import load_dotenv
+from llm_provider import chat_completion
+from model_router import route
+
+load_dotenv()
+MAX_DIGEST_KEYWORDS = 8
+MAX_DIGEST_WEAKNESSES = 3
+MAX_DIGEST_FIELD_CHARS = 200
+
+def _clean_digest(raw: dict, website_data: dict) -> dict:
+    """Keep only the expected fields, trimmed to a small size."""
+    def text(value):
+        return str(value).strip()[:MAX_DIGEST_FIELD_CHARS] if value else ""
+
+    def items(value, limit):
+        if isinstance(value, str):
+            value = [value]
+        return [text(item) for item in (value or []) if text(item)][:limit]
+
+    return {
+        'industry': text(raw.get('industry')),
+        'offering': text(raw.get('offering')),
+        'audience': text(raw.get('audience')),
+        'weaknesses': items(raw.get('weaknesses'), MAX_DIGEST_WEAKNESSES),
+        # The site's own keywords are the fallback when the model gives none
+        'keywords': items(raw.get('keywords') or website_data.get('keywords'), MAX_DIGEST_KEYWORDS),
+    }
+
+async def distill_profile(website_data: dict, analysis_report: str = None) -> dict:
+    """
+    Distill the website data and analysis report into a compact digest
+    (industry, offering, audience, weaknesses, keywords) used in chat
+    prompts instead of the full report. Without a report the digest comes
+    from the website data alone. Falls back to the site's own keywords if
+    the model call fails.
+    """
+    system_prompt = """استخرج من بيانات الموقع وتقرير التحليل ملخصاً موجزاً بصيغة JSON فقط بالمفاتيح التالية:
+    - industry: الصناعة أو القطاع (عبارة قصيرة)
+    - offering: ما تقدمه الشركة من منتجات أو خدمات (جملة واحدة)
+    - audience: الجمهور المستهدف (جملة واحدة)
+    - weaknesses: قائمة بأهم ثلاث نقاط ضعف على الأكثر (عبارات قصيرة)
+    - keywords: قائمة بثماني كلمات مفتاحية على الأكثر
+    اكتب القيم باللغة العربية."""
+
+    site = f"""
+    النطاق: {website_data.get('domain', '')}
+    العنوان: {website_data.get('title', '')}
+    الوصف: {website_data.get('description', '')}
+    الكلمات المفتاحية: {'، '.join(website_data.get('keywords') or [])}
+    محتوى أولي: {website_data.get('content_preview', '')}
+    """
+
+    try:
+        response = await chat_completion(
+            model=route('digest')['model'],
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"بيانات الموقع:\n{site}" + (f"\n\nتقرير التحليل:\n{analysis_report}" if analysis_report else "")},
+            ],
+            temperature=0,
+            response_format={"type": "json_object"},
+            hedge=True,
+        )
+        raw = json.loads(response.choices[0].message.content)
+        if not isinstance(raw, dict):
+            raw = {}
+    except Exception as e:
+        print(f"Profile digest failed, keeping site keywords only: {e}")
+        raw = {}
+
+    return _clean_digest(raw, website_data)
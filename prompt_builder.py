@@ -0,0 +1,116 @@
+# prompt_builder.py
+import os
+from token_count import count_tokens, truncate_tokens
+
+# Upper bound on the tokens sent per chat request (prompt only, before the reply)
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "3000"))
+# Per-section caps, applied before the overall budget
+PROMPT_PROFILE_TOKENS = int(os.getenv("PROMPT_PROFILE_TOKENS", "300"))
+PROMPT_ANALYSIS_TOKENS = int(os.getenv("PROMPT_ANALYSIS_TOKENS", "600"))
+PROMPT_RAG_TOKENS = int(os.getenv("PROMPT_RAG_TOKENS", "1300"))
+PROMPT_HISTORY_TOKENS = int(os.getenv("PROMPT_HISTORY_TOKENS", "800"))
+PROMPT_SUMMARY_TOKENS = int(os.getenv("PROMPT_SUMMARY_TOKENS", "300"))
+PROMPT_HISTORY_MESSAGES = 6  # last 3 user-bot pairs
+
+# Chat formatting overhead per message (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Trimmed from the highest number down when the prompt is over budget
+SECTION_PRIORITY = {
+    'profile': 1,
+    'history': 2,
+    'summary': 3,
+    'rag': 4,
+    'analysis': 5,
+}
+
+def _history_messages(history: list[str]) -> list[dict]:
+    # Roles come from the position in the last pairs, before anything is dropped
+    recent = history[-PROMPT_HISTORY_MESSAGES:]
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": text}
+        for i, text in enumerate(recent)
+    ]
+
+def _fit_history(messages: list[dict], budget: int) -> list[dict]:
+    """Keep the most recent history messages that fit in the budget."""
+    kept = []
+    used = 0
+    for item in reversed(messages):
+        cost = count_tokens(item["content"]) + MESSAGE_OVERHEAD_TOKENS
+        if used + cost > budget:
+            break
+        kept.append(item)
+        used += cost
+    return list(reversed(kept))
+
+def _history_tokens(messages: list[dict]) -> int:
+    return sum(count_tokens(item["content"]) + MESSAGE_OVERHEAD_TOKENS for item in messages)
+
+def build_messages(system_prompt: str, message: str, profile: str = "", analysis: str = "",
+                   context: str = "", history: list[str] = None, summary: str = "",
+                   max_tokens: int = PROMPT_MAX_TOKENS, label: str = ""):
+    """
+    Assemble the chat messages for one turn within a token budget.
+
+    The base system prompt and the user's message are always sent. Each
+    other section is first capped to its own budget; if the total is still
+    over max_tokens, sections are trimmed in SECTION_PRIORITY order, lowest
+    priority first. summary is the rolling summary of turns older than
+    history. Returns (messages, usage) where usage maps each section to the
+    tokens it ended up using.
+    """
+    sections = {
+        'profile': truncate_tokens(profile.strip(), PROMPT_PROFILE_TOKENS) if profile else "",
+        'analysis': truncate_tokens(analysis.strip(), PROMPT_ANALYSIS_TOKENS) if analysis else "",
+        'rag': truncate_tokens(context.strip(), PROMPT_RAG_TOKENS) if context else "",
+        'summary': truncate_tokens(summary.strip(), PROMPT_SUMMARY_TOKENS) if summary else "",
+    }
+    history_messages = _fit_history(_history_messages(history or []), PROMPT_HISTORY_TOKENS)
+
+    usage = {name: count_tokens(text) for name, text in sections.items()}
+    usage['history'] = _history_tokens(history_messages)
+    fixed = count_tokens(system_prompt) + count_tokens(message) + 3 * MESSAGE_OVERHEAD_TOKENS
+
+    trimmed = []
+    overflow = fixed + sum(usage.values()) - max_tokens
+    for name in sorted(SECTION_PRIORITY, key=SECTION_PRIORITY.get, reverse=True):
+        if overflow <= 0:
+            break
+        if not usage[name]:
+            continue
+        target = max(usage[name] - overflow, 0)
+        if name == 'history':
+            history_messages = _fit_history(history_messages, target)
+            new_usage = _history_tokens(history_messages)
+        else:
+            sections[name] = truncate_tokens(sections[name], target)
+            new_usage = count_tokens(sections[name])
+        overflow -= usage[name] - new_usage
+        usage[name] = new_usage
+        trimmed.append(name)
+
+    system_content = system_prompt
+    if sections['profile']:
+        system_content += f"\n\n{sections['profile']}"
+    if sections['analysis']:
+        system_content += f"\nتحليل الموقع:\n{sections['analysis']}"
+    if sections['profile'] or sections['analysis']:
+        system_content += "\nاستخدم هذه المعلومات لتقديم نصائح مخصصة."
+
+    messages = [{"role": "system", "content": system_content}]
+    if sections['rag']:
+        messages.append({"role": "system", "content": sections['rag']})
+    if sections['summary']:
+        messages.append({"role": "system", "content": f"ملخص المحادثة السابقة مع المستخدم:\n{sections['summary']}"})
+    messages.extend(history_messages)
+    messages.append({"role": "user", "content": message})
+
+    usage['fixed'] = fixed
+    usage['total'] = fixed + sum(usage[name] for name in SECTION_PRIORITY)
+    print(
+        f"Prompt tokens{f' [{label}]' if label else ''}: total={usage['total']}/{max_tokens} "
+        + " ".join(f"{name}={usage[name]}" for name in ('fixed', *SECTION_PRIORITY))
+        + (f" trimmed={','.join(trimmed)}" if trimmed else "")
+    )
+    return messages, usage
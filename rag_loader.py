@@ -1,45 +1,440 @@
 # rag_loader.py
 import os
 import glob
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
+import hashlib
+import multiprocessing
+import random
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+import openai
+import pypdf
+from langchain_community.document_loaders import TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.schema.document import Document
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import OpenAIEmbeddings
+from chroma_memory import publish_index_version
+from token_count import count_tokens
 
-CHROMA_DIR = "chroma_db"
+# Directory of the persisted vector store
+CHROMA_DIR = os.getenv("CHROMA_DIR", "chroma_db")
+MANIFEST_FILE = "ingest_manifest.db"
 
-# Step 1: Load PDF or .txt files from a directory
+# Chunks embedded and committed per batch; a crashed run resumes after the last batch
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+# Processes used to parse source files
+INGEST_PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", str(os.cpu_count() or 1)))
+# Embedding batches in flight at once (lowered automatically on 429s)
+INGEST_EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", "4"))
+# Attempts per batch before a rate-limited batch fails the run
+INGEST_MAX_RETRIES = int(os.getenv("INGEST_MAX_RETRIES", "8"))
+# PDF pages parsed per worker task; bounds the memory of one parse result
+INGEST_PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", "8"))
+# Parse tasks a worker process runs before it is replaced (releases parser memory)
+INGEST_TASKS_PER_WORKER = int(os.getenv("INGEST_TASKS_PER_WORKER", "50"))
+# Soft RSS ceiling: no new parse tasks or embedding batches start above it
+INGEST_MAX_MEMORY_MB = int(os.getenv("INGEST_MAX_MEMORY_MB", "1024"))
+
+SUPPORTED_EXTENSIONS = (".pdf", ".txt")
+
+class IngestManifest:
+    """
+    Record of what is already in the vector store: one row per source file
+    (content hash + whether it was fully ingested) and one row per chunk ID.
+    """
+
+    def __init__(self, persist_directory=CHROMA_DIR):
+        os.makedirs(persist_directory, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(persist_directory, MANIFEST_FILE))
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                file_hash TEXT,
+                complete INTEGER DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                path TEXT
+            );
+            CREATE INDEX IF NOT EXISTS chunks_by_path ON chunks (path);
+        """)
+        self.conn.commit()
+
+    def is_empty(self) -> bool:
+        return self.conn.execute("SELECT 1 FROM files LIMIT 1").fetchone() is None
+
+    def known_files(self) -> set:
+        return {row[0] for row in self.conn.execute("SELECT path FROM files")}
+
+    def file_state(self, path: str):
+        row = self.conn.execute("SELECT file_hash, complete FROM files WHERE path = ?", (path,)).fetchone()
+        return (row[0], bool(row[1])) if row else (None, False)
+
+    def chunk_ids(self, path: str) -> set:
+        return {row[0] for row in self.conn.execute("SELECT chunk_id FROM chunks WHERE path = ?", (path,))}
+
+    def begin_file(self, path: str, file_hash: str):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, file_hash, complete) VALUES (?, ?, 0)",
+            (path, file_hash)
+        )
+        self.conn.commit()
+
+    def add_chunks(self, path: str, chunk_ids: list):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO chunks (chunk_id, path) VALUES (?, ?)",
+            [(chunk_id, path) for chunk_id in chunk_ids]
+        )
+        self.conn.commit()
+
+    def remove_chunks(self, chunk_ids):
+        self.conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(chunk_id,) for chunk_id in chunk_ids])
+        self.conn.commit()
+
+    def finish_file(self, path: str):
+        self.conn.execute("UPDATE files SET complete = 1 WHERE path = ?", (path,))
+        self.conn.commit()
+
+    def remove_file(self, path: str):
+        self.conn.execute("DELETE FROM chunks WHERE path = ?", (path,))
+        self.conn.execute("DELETE FROM files WHERE path = ?", (path,))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+def file_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_id(chunk) -> str:
+    """Stable ID derived from where the chunk comes from and what it contains."""
+    meta = chunk.metadata
+    key = f"{meta.get('source')}\0{meta.get('page', 0)}\0{meta.get('start_index', 0)}\0{chunk.page_content}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def list_source_files(folder_path: str) -> list:
+    return sorted(
+        path for path in glob.glob(f"{folder_path}/*")
+        if path.endswith(SUPPORTED_EXTENSIONS)
+    )
+
+def _rss_mb() -> float:
+    """Current resident set size of this process in MB (0 where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return 0.0
+
+def _over_memory() -> bool:
+    return _rss_mb() > INGEST_MAX_MEMORY_MB
+
+# Step 1: Load pages of a PDF or .txt file, a few at a time
+def page_ranges(file_path: str) -> list:
+    """Split a file into (start, end) page ranges small enough to parse in one task."""
+    if not file_path.endswith(".pdf"):
+        return [(0, 1)]
+    page_count = len(pypdf.PdfReader(file_path).pages)
+    return [
+        (start, min(start + INGEST_PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, INGEST_PAGES_PER_TASK)
+    ]
+
+def load_pages(file_path: str, start: int = 0, end: int = None):
+    """Yield one Document per page (the whole file for .txt), same metadata as PyPDFLoader."""
+    if not file_path.endswith(".pdf"):
+        yield from TextLoader(file_path).lazy_load()
+        return
+    with open(file_path, "rb") as f:
+        reader = pypdf.PdfReader(f)
+        end = len(reader.pages) if end is None else min(end, len(reader.pages))
+        for page_number in range(start, end):
+            yield Document(
+                page_content=reader.pages[page_number].extract_text(),
+                metadata={"source": file_path, "page": page_number},
+            )
+
+# Lazily load PDF or .txt files from a directory, page by page
 def load_documents(folder_path: str):
-    all_files = glob.glob(f"{folder_path}/*")
-    docs = []
-    for file_path in all_files:
-        if file_path.endswith(".pdf"):
-            loader = PyPDFLoader(file_path)
-        elif file_path.endswith(".txt"):
-            loader = TextLoader(file_path)
-        else:
-            continue
-        docs.extend(loader.load())
-    return docs
+    for file_path in list_source_files(folder_path):
+        yield from load_pages(file_path)
 
 # Step 2: Split into chunks
 def split_documents(docs):
-    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100, add_start_index=True)
     return splitter.split_documents(docs)
 
-# Step 3: Embed and save to Chroma
-def embed_and_store(docs, persist_directory=CHROMA_DIR):
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-    vectordb = Chroma.from_documents(docs, embedding=embeddings, persist_directory=persist_directory)
-    vectordb.persist()
-    print(f"✅ Stored {len(docs)} chunks into Chroma.")
+def _parse_task(file_path: str, start: int, end: int) -> list:
+    """Process-pool worker: load and split a page range into (chunk_id, chunk) pairs."""
+    return [(chunk_id(chunk), chunk) for chunk in split_documents(load_pages(file_path, start, end))]
+
+def _batched(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def _drop_legacy_index(vectordb):
+    """Indexes built before the manifest existed have random IDs; clear them once."""
+    legacy_ids = vectordb.get(include=[])["ids"]
+    if legacy_ids:
+        print(f"🧹 Removing {len(legacy_ids)} chunks from an index built without a manifest.")
+        for batch in _batched(legacy_ids, 5000):
+            vectordb.delete(ids=batch)
+
+class _AdaptiveConcurrency:
+    """
+    AIMD limit on in-flight embedding batches: a 429 halves the limit and the
+    batch is retried with jittered exponential backoff; a run of successes
+    raises the limit again by one.
+    """
+
+    def __init__(self, maximum: int):
+        self.maximum = max(1, maximum)
+        self.limit = self.maximum
+        self.rate_limited = 0
+        self._successes = 0
+        self._lock = threading.Lock()
+
+    def call(self, func, *args):
+        attempt = 0
+        while True:
+            try:
+                result = func(*args)
+            except openai.RateLimitError:
+                attempt += 1
+                with self._lock:
+                    self.limit = max(1, self.limit // 2)
+                    self._successes = 0
+                    self.rate_limited += 1
+                if attempt >= INGEST_MAX_RETRIES:
+                    raise
+                time.sleep(min(60, 2 ** attempt) * random.uniform(0.5, 1.5))
+                continue
+            with self._lock:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self._successes = 0
+            return result
+
+class _EmbeddingPipeline:
+    """
+    Groups incoming chunks into fixed-size batches, embeds several batches at
+    a time on a thread pool and commits each finished batch to Chroma and the
+    manifest from the calling thread (so a crash never loses more than the
+    batches in flight). New batches wait while the process is over its
+    memory ceiling.
+    """
+
+    def __init__(self, embeddings, vectordb, manifest, on_committed, concurrency=INGEST_EMBED_CONCURRENCY):
+        self.embeddings = embeddings
+        self.vectordb = vectordb
+        self.manifest = manifest
+        self.on_committed = on_committed
+        self.controller = _AdaptiveConcurrency(concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=self.controller.maximum)
+        self.buffer = []
+        self.in_flight = set()
+        self.outstanding = defaultdict(int)
+        self.chunks = 0
+        self.tokens = 0
+
+    def add(self, path: str, pending: list):
+        for cid, chunk in pending:
+            self.buffer.append((path, cid, chunk))
+            self.outstanding[path] += 1
+            if len(self.buffer) >= INGEST_BATCH_SIZE:
+                self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        while self.in_flight and (len(self.in_flight) >= self.controller.limit or _over_memory()):
+            self._collect()
+        self.in_flight.add(self.executor.submit(self._embed, batch))
+
+    def _embed(self, batch: list):
+        texts = [chunk.page_content for _, _, chunk in batch]
+        vectors = self.controller.call(self.embeddings.embed_documents, texts)
+        tokens = sum(count_tokens(text) for text in texts)
+        return batch, vectors, tokens
+
+    def _collect(self):
+        done, _ = wait(self.in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            self.in_flight.remove(future)
+            batch, vectors, tokens = future.result()
+            self.vectordb._collection.upsert(
+                ids=[cid for _, cid, _ in batch],
+                embeddings=vectors,
+                documents=[chunk.page_content for _, _, chunk in batch],
+                metadatas=[chunk.metadata for _, _, chunk in batch],
+            )
+            by_path = defaultdict(list)
+            for path, cid, _ in batch:
+                by_path[path].append(cid)
+            for path, ids in by_path.items():
+                self.manifest.add_chunks(path, ids)
+                self.outstanding[path] -= len(ids)
+                if not self.outstanding[path]:
+                    del self.outstanding[path]
+                self.on_committed(path)
+            self.chunks += len(batch)
+            self.tokens += tokens
+
+    def drain(self):
+        self.flush()
+        while self.in_flight:
+            self._collect()
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+# Step 3: Stream pages -> chunks -> embedding batches -> store, touching only
+# what changed since the last run
+def ingest(folder_path: str, persist_directory=CHROMA_DIR):
+    started = time.monotonic()
+    peak_rss = _rss_mb()
+    # Retries are handled by the pipeline so it can adapt its concurrency
+    embeddings = OpenAIEmbeddings(model="text-embedding-3-small", max_retries=0)
+    vectordb = Chroma(persist_directory=persist_directory, embedding_function=embeddings)
+    manifest = IngestManifest(persist_directory)
+    if manifest.is_empty():
+        _drop_legacy_index(vectordb)
+
+    files = list_source_files(folder_path)
+    removed = 0
+
+    # Files that disappeared from the folder: remove their chunks
+    for path in sorted(manifest.known_files() - set(files)):
+        stale = list(manifest.chunk_ids(path))
+        if stale:
+            vectordb.delete(ids=stale)
+        manifest.remove_file(path)
+        removed += len(stale)
+        print(f"🗑️ {path}: removed {len(stale)} chunks (file deleted).")
+
+    to_parse = []
+    for path in files:
+        current_hash = file_hash(path)
+        stored_hash, complete = manifest.file_state(path)
+        if stored_hash == current_hash and complete:
+            continue
+        if stored_hash != current_hash:
+            manifest.begin_file(path, current_hash)
+        to_parse.append(path)
+
+    # Per-file progress for files currently being parsed (chunk IDs only)
+    active = {}
+
+    def finish_if_done(path):
+        nonlocal removed
+        state = active.get(path)
+        if state is None or state['tasks'] or pipeline.outstanding.get(path):
+            return
+        del active[path]
+        stale = list(state['existing'] - state['seen'])
+        if stale:
+            vectordb.delete(ids=stale)
+            manifest.remove_chunks(stale)
+        removed += len(stale)
+        manifest.finish_file(path)
+        print(f"📄 {path}: {state['new']} new chunks, {len(stale)} removed, {len(state['seen'])} total.")
+
+    def tasks():
+        for path in to_parse:
+            ranges = page_ranges(path)
+            active[path] = {
+                'tasks': len(ranges),
+                'existing': manifest.chunk_ids(path),
+                'seen': set(),
+                'new': 0,
+            }
+            if not ranges:
+                finish_if_done(path)
+            for start, end in ranges:
+                yield path, start, end
+
+    pipeline = _EmbeddingPipeline(embeddings, vectordb, manifest, on_committed=finish_if_done)
+    try:
+        if to_parse:
+            workers = max(1, INGEST_PARSE_WORKERS)
+            # Parsed-but-unembedded pages are bounded by this window
+            window = workers * 2
+            pending_tasks = tasks()
+            futures = {}
+
+            def submit_more():
+                while len(futures) < window and (not futures or not _over_memory()):
+                    task = next(pending_tasks, None)
+                    if task is None:
+                        return
+                    futures[parse_pool.submit(_parse_task, *task)] = task[0]
+
+            # spawn: forking a process that already runs Chroma threads is unsafe
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                     max_tasks_per_child=INGEST_TASKS_PER_WORKER) as parse_pool:
+                submit_more()
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        path = futures.pop(future)
+                        state = active[path]
+                        # Embed only chunks we have not stored yet (also skips
+                        # batches committed by an interrupted run)
+                        pending = []
+                        for cid, chunk in future.result():
+                            if cid in state['seen']:
+                                continue
+                            state['seen'].add(cid)
+                            if cid not in state['existing']:
+                                pending.append((cid, chunk))
+                        state['new'] += len(pending)
+                        pipeline.add(path, pending)
+                        state['tasks'] -= 1
+                        finish_if_done(path)
+                    peak_rss = max(peak_rss, _rss_mb())
+                    submit_more()
+        pipeline.drain()
+        for path in list(active):
+            finish_if_done(path)
+    finally:
+        pipeline.close()
+        manifest.close()
+
+    added = pipeline.chunks
+    if added or removed:
+        vectordb.persist()
+        # Tell running servers to reopen the index
+        publish_index_version(persist_directory)
+
+    elapsed = max(time.monotonic() - started, 1e-9)
+    stats = {
+        'added': added,
+        'removed': removed,
+        'tokens': pipeline.tokens,
+        'seconds': round(elapsed, 2),
+        'chunks_per_second': round(added / elapsed, 1),
+        'tokens_per_second': round(pipeline.tokens / elapsed, 1),
+        'rate_limited': pipeline.controller.rate_limited,
+        'peak_rss_mb': round(max(peak_rss, _rss_mb()), 1),
+    }
+    print(f"✅ Added {added} chunks and removed {removed} chunks in Chroma.")
+    print(f"⏱️ {stats['seconds']} s, {stats['chunks_per_second']} chunks/s, "
+          f"{stats['tokens_per_second']} tokens/s, {stats['rate_limited']} rate-limited requests, "
+          f"peak RSS {stats['peak_rss_mb']} MB.")
+    return stats
 
 # Run this file as a script to ingest
 if __name__ == "__main__":
     folder = "docs"  # put your PDFs or .txt files here
-    print("📄 Loading documents...")
-    raw_docs = load_documents(folder)
-    print(f"Loaded {len(raw_docs)} raw documents.")
-    chunks = split_documents(raw_docs)
-    print(f"🧠 Split into {len(chunks)} chunks.")
-    embed_and_store(chunks)
+    print("📄 Ingesting changed documents...")
+    ingest(folder)
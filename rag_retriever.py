@@ -1,12 +1,88 @@
 # rag_retriever.py
-from chroma_memory import query_memory
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import TimeoutError as FutureTimeout
+from chroma_memory import vector_search, lexical_search, embed_query, get_chunk_embeddings
+from rerank import select_passages
+from thread_pool import vector_executor
+
+# Candidates taken from each ranking before fusion and re-ranking
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+# Seconds to wait for embedding + vector search before using lexical hits alone
+HYBRID_VECTOR_TIMEOUT = float(os.getenv("HYBRID_VECTOR_TIMEOUT", "3"))
+# Standard reciprocal rank fusion constant
+RRF_K = 60
+
+def reciprocal_rank_fusion(rankings, k=RRF_K) -> list:
+    """Merge several ranked (chunk_id, doc) lists into one, best first."""
+    scores = defaultdict(float)
+    docs = {}
+    for ranking in rankings:
+        for rank, (chunk_id, doc) in enumerate(ranking):
+            scores[chunk_id] += 1.0 / (k + rank + 1)
+            docs.setdefault(chunk_id, doc)
+    return [(chunk_id, docs[chunk_id]) for chunk_id in sorted(scores, key=scores.get, reverse=True)]
+
+def _hybrid_candidates(user_query: str):
+    """
+    Run vector and BM25 search side by side and fuse the rankings. The
+    lexical side is local, so it still answers if the embedding API is slow
+    or failing. Returns the fused (chunk_id, doc) list and whether the vector
+    side answered in time.
+    """
+    submitted_at = time.monotonic()
+    vector_future = vector_executor.submit(vector_search, user_query, HYBRID_CANDIDATES)
+    try:
+        lexical = lexical_search(user_query, HYBRID_CANDIDATES)
+    except Exception as e:
+        print(f"Lexical search failed: {e}")
+        lexical = []
+    vector_ok = False
+    try:
+        # One timeout from submission, queueing included, so the retrieval
+        # gate's deadline always leaves time for the lexical-only answer
+        left = HYBRID_VECTOR_TIMEOUT - (time.monotonic() - submitted_at)
+        vector = vector_future.result(timeout=max(left, 0))
+        vector_ok = True
+    except FutureTimeout:
+        vector_future.cancel()  # drops it if still queued; a running search finishes on its own
+        print("Vector search timed out; using lexical results only")
+        vector = []
+    except Exception as e:
+        print(f"Vector search failed: {e}")
+        vector = []
+    return reciprocal_rank_fusion([vector, lexical]), vector_ok
+
+def hybrid_search(user_query: str, top_k=4) -> list:
+    candidates, _ = _hybrid_candidates(user_query)
+    return [doc for _, doc in candidates[:top_k]]
+
+def retrieve_passages(user_query: str) -> list:
+    """
+    Fetch hybrid candidates, then re-rank them with MMR, drop near-duplicates
+    and merge overlapping chunks until the context token budget is filled.
+    """
+    candidates, vector_ok = _hybrid_candidates(user_query)
+    if not candidates:
+        return []
+    query_embedding = candidate_embeddings = None
+    if vector_ok:
+        try:
+            # Served from the embedding cache: the vector search just computed it
+            query_embedding = embed_query(user_query)
+            candidate_embeddings = get_chunk_embeddings([chunk_id for chunk_id, _ in candidates])
+        except Exception as e:
+            print(f"Could not load embeddings for re-ranking: {e}")
+    return select_passages([doc for _, doc in candidates], query_embedding, candidate_embeddings)
 
 def retrieve_context(user_query: str) -> str:
     """
-    Search vector memory and build a context string from the top chunks.
+    Search vector + lexical memory and build a context string from the
+    re-ranked passages.
     """
     try:
-        results = query_memory(user_query, top_k=4)
+        results = retrieve_passages(user_query)
         if not results:
             return ""
 
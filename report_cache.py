@@ -0,0 +1,143 @@
+# report_cache.py
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from thread_pool import run_blocking
+
+REPORT_CACHE_DB = os.getenv("REPORT_CACHE_DB", "report_cache.db")
+# Seconds a finished analysis report is reused for the same page and profile
+REPORT_CACHE_TTL = int(os.getenv("REPORT_CACHE_TTL", "86400"))
+# Reports kept on disk; the oldest go first
+REPORT_CACHE_MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "2000"))
+
+# Page fields and profile fields that go into the report prompt
+PAGE_KEY_FIELDS = ('domain', 'title', 'description', 'keywords', 'content_preview', 'headings', 'organization',
+                   'pages')
+PROFILE_KEY_FIELDS = ('name', 'business_type', 'goals')
+
+def _normalize(value) -> str:
+    if isinstance(value, (list, tuple)):
+        value = '، '.join(str(v) for v in value)
+    elif isinstance(value, dict):
+        value = json.dumps(value, ensure_ascii=False, sort_keys=True)
+    return ' '.join(str(value or '').casefold().split())
+
+def report_key(website_data: dict, user_profile: dict = None) -> str:
+    """
+    Hash of everything the report depends on: the extracted page fields and
+    the profile fields used to personalize it (all empty without a profile).
+    """
+    payload = {
+        'page': {field: _normalize(website_data.get(field)) for field in PAGE_KEY_FIELDS},
+        'profile': {field: _normalize((user_profile or {}).get(field)) for field in PROFILE_KEY_FIELDS},
+    }
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+class ReportCache:
+    """
+    Finished analysis reports in SQLite with a TTL, plus single-flight
+    generation: concurrent requests for the same key wait on one in-flight
+    task instead of each making the model call.
+    """
+
+    def __init__(self, path: str = REPORT_CACHE_DB, ttl: int = REPORT_CACHE_TTL,
+                 max_entries: int = REPORT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> asyncio.Task, touched only on the event loop
+        self._stats = {'hits': 0, 'misses': 0, 'joined': 0, 'stores': 0, 'expired': 0, 'evictions': 0}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS reports (
+                key TEXT PRIMARY KEY,
+                domain TEXT,
+                report TEXT,
+                created_at REAL
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT report, created_at FROM reports WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._stats['misses'] += 1
+                return None
+            report, created_at = row
+            if time.time() - created_at >= self.ttl:
+                self._conn.execute("DELETE FROM reports WHERE key = ?", (key,))
+                self._conn.commit()
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._stats['hits'] += 1
+            return report
+
+    def put(self, key: str, domain: str, report: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO reports (key, domain, report, created_at) VALUES (?, ?, ?, ?)",
+                (key, domain, report, time.time())
+            )
+            self._stats['stores'] += 1
+            overflow = self._conn.execute("SELECT COUNT(*) FROM reports").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM reports WHERE key IN (SELECT key FROM reports ORDER BY created_at LIMIT ?)",
+                    (overflow,)
+                )
+                self._stats['evictions'] += overflow
+            self._conn.commit()
+
+    async def _generate_and_store(self, key: str, domain: str, generate):
+        report = await generate()
+        await run_blocking(self.put, key, domain, report)
+        return report
+
+    def _finished(self, key: str, task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # retrieved here in case every waiter has gone
+
+    async def get_or_generate(self, key: str, domain: str, generate):
+        """
+        The cached report for key, or the result of generate() (a coroutine
+        function), stored once it succeeds; failures are not cached. The
+        generation runs as its own task, so a caller that disconnects does
+        not cancel it for the others waiting on it.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            report = await run_blocking(self.get, key)
+            if report is not None:
+                return report
+            # Another request may have started it while we were looking
+            task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._generate_and_store(key, domain, generate))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self._stats['joined'] += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {
+                **self._stats,
+                'entries': entries,
+                'in_flight': len(self._inflight),
+                'hit_rate': self._stats['hits'] / lookups if lookups else 0.0,
+            }
+
+report_cache = ReportCache()
+
+def get_report_cache_stats() -> dict:
+    return report_cache.stats()
@@ -0,0 +1,47 @@
+# request_context.py
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+# Time allowed for one API request end to end; kept under the frontend's 120 s timeout
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "100"))
+
+# Monotonic time by which the current request must finish (None = no deadline)
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+# User the current request is for, used for fair scheduling of model calls
+_user_id = contextvars.ContextVar("request_user_id", default=None)
+
+@contextmanager
+def request_deadline(seconds: float = REQUEST_DEADLINE_SECONDS):
+    """
+    Set the deadline for everything awaited inside the block. A deadline
+    that is already set and earlier is kept.
+    """
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        deadline = min(deadline, current)
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+def remaining(default: float = None) -> float:
+    """Seconds left before the current deadline (never negative), or default if none is set."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    return max(deadline - time.monotonic(), 0.0)
+
+def bounded_timeout(timeout: float) -> float:
+    """timeout, shortened to what is left of the current deadline."""
+    left = remaining()
+    return timeout if left is None else min(timeout, left)
+
+def set_current_user(user_id: str):
+    _user_id.set(user_id)
+
+def current_user() -> str:
+    return _user_id.get()
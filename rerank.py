@@ -0,0 +1,98 @@
+# rerank.py
+import os
+import numpy as np
+from langchain.schema.document import Document
+from arabic_text import normalize_arabic
+from token_count import count_tokens
+
+# Relevance vs. diversity trade-off for maximal marginal relevance (1.0 = relevance only)
+RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+# Candidates more similar than this to an already selected chunk are dropped
+RAG_DUPLICATE_THRESHOLD = float(os.getenv("RAG_DUPLICATE_THRESHOLD", "0.95"))
+# Token budget for the retrieved context placed in the prompt
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "1200"))
+
+def mmr_order(query_embedding, embeddings, lambda_mult=RAG_MMR_LAMBDA,
+              duplicate_threshold=RAG_DUPLICATE_THRESHOLD) -> list[int]:
+    """
+    Order candidate indexes by maximal marginal relevance, dropping
+    near-duplicates of chunks that were already picked.
+    """
+    if not embeddings:
+        return []
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query /= np.linalg.norm(query) + 1e-12
+    relevance = vectors @ query
+
+    selected = []
+    remaining = list(range(len(vectors)))
+    while remaining:
+        if selected:
+            redundancy = (vectors[remaining] @ vectors[selected].T).max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining), dtype=np.float32)
+        scores = lambda_mult * relevance[remaining] - (1 - lambda_mult) * redundancy
+        best = int(np.argmax(scores))
+        index = remaining.pop(best)
+        if redundancy[best] >= duplicate_threshold:
+            continue
+        selected.append(index)
+    return selected
+
+def _span(doc: Document):
+    start = doc.metadata.get("start_index")
+    if start is None:
+        return None
+    return doc.metadata.get("source"), doc.metadata.get("page"), start, start + len(doc.page_content)
+
+def merge_overlapping(docs: list[Document]) -> list[Document]:
+    """
+    Merge chunks that are adjacent or overlapping slices of the same page
+    into one passage, keeping the order in which passages first appear.
+    """
+    merged = []
+    for doc in docs:
+        span = _span(doc)
+        for i, existing in enumerate(merged):
+            other = _span(existing)
+            if span is None or other is None or span[:2] != other[:2]:
+                continue
+            first, second = (existing, doc) if other[2] <= span[2] else (doc, existing)
+            first_span, second_span = _span(first), _span(second)
+            if second_span[2] > first_span[3]:
+                continue  # a gap between them; keep separate
+            text = first.page_content
+            if second_span[3] > first_span[3]:
+                text += second.page_content[first_span[3] - second_span[2]:]
+            merged[i] = Document(page_content=text, metadata={**first.metadata, "start_index": first_span[2]})
+            break
+        else:
+            merged.append(doc)
+    return merged
+
+def select_passages(candidates: list[Document], query_embedding=None, candidate_embeddings=None,
+                    token_budget=RAG_CONTEXT_TOKENS) -> list[Document]:
+    """
+    Re-rank retrieved chunks (MMR when embeddings are available, otherwise
+    the given order), suppress duplicates and merge overlapping chunks,
+    taking passages until the token budget is used up.
+    """
+    if query_embedding is not None and candidate_embeddings and all(e is not None for e in candidate_embeddings):
+        ordered = [candidates[i] for i in mmr_order(query_embedding, candidate_embeddings)]
+    else:
+        ordered = list(candidates)
+
+    selected = []
+    seen_texts = set()
+    for doc in ordered:
+        key = " ".join(normalize_arabic(doc.page_content).split())
+        if key in seen_texts:
+            continue
+        seen_texts.add(key)
+        passages = merge_overlapping(selected + [doc])
+        if sum(count_tokens(p.page_content) for p in passages) > token_budget:
+            continue
+        selected.append(doc)
+    return merge_overlapping(selected)
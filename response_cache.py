@@ -0,0 +1,178 @@
+# response_cache.py
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+import numpy as np
+from arabic_text import normalize_arabic
+from chroma_memory import embed_query
+from retrieval_gate import PROFILE_INTENTS
+from thread_pool import run_blocking
+
+# Off unless explicitly enabled
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+# Cosine similarity above which a cached answer is reused for a new question
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95"))
+# Seconds a cached answer stays valid
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+# Mid-conversation questions shorter than this (words) are taken as follow-ups
+RESPONSE_CACHE_MIN_WORDS = int(os.getenv("RESPONSE_CACHE_MIN_WORDS", "4"))
+
+# Questions about the user's own site, company or customers get answers that
+# depend on more than the profile fingerprint (normalized form)
+PERSONAL_TERMS = [
+    normalize_arabic(term) for term in [
+        "موقعي", "شركتي", "متجري", "منتجي", "منتجاتي", "خدماتي", "عملائي", "علامتي", "مشروعي",
+        "my website", "my site", "my company", "my store", "my product", "my brand", "my customers",
+    ]
+]
+
+# Words that point back at earlier turns ("explain more", "the second point");
+# the answer depends on the conversation, not just the question (normalized form)
+FOLLOW_UP_TERMS = {
+    normalize_arabic(term) for term in [
+        "اشرح", "وضح", "فصل", "أكثر", "المزيد", "كمان", "أيضاً", "ايضا", "هذا", "هذه", "ذلك", "تلك", "هذي",
+        "السابق", "السابقة", "الأولى", "الثانية", "الثالثة", "النقطة", "النقاط", "مثال", "لماذا", "وكيف",
+        "more", "explain", "elaborate", "this", "that", "these", "those", "it", "above", "previous", "point", "why",
+    ]
+}
+
+_URL = re.compile(r"https?://|www\.")
+
+class ResponseCache:
+    """
+    Answers keyed by the question's embedding within a profile fingerprint.
+    A lookup returns the most similar live entry above the threshold; the
+    least recently used entries are evicted beyond max_entries.
+    """
+
+    def __init__(self, threshold: float = RESPONSE_CACHE_THRESHOLD, ttl: float = RESPONSE_CACHE_TTL,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # entry id -> (fingerprint, unit vector, response, stored_at)
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expired': 0}
+
+    def get(self, fingerprint: str, embedding) -> str:
+        vector = _unit(embedding)
+        now = time.monotonic()
+        with self._lock:
+            best_id, best_score = None, self.threshold
+            for entry_id, (entry_fingerprint, entry_vector, _, stored_at) in list(self._entries.items()):
+                if now - stored_at > self.ttl:
+                    del self._entries[entry_id]
+                    self._stats['expired'] += 1
+                    continue
+                if entry_fingerprint != fingerprint:
+                    continue
+                score = float(entry_vector @ vector)
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self._stats['hits'] += 1
+            return self._entries[best_id][2]
+
+    def put(self, fingerprint: str, embedding, response: str):
+        with self._lock:
+            self._entries[self._next_id] = (fingerprint, _unit(embedding), response, time.monotonic())
+            self._next_id += 1
+            self._stats['stores'] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {
+                **self._stats,
+                'entries': len(self._entries),
+                'enabled': RESPONSE_CACHE_ENABLED,
+                'hit_rate': self._stats['hits'] / lookups if lookups else 0.0,
+            }
+
+def _unit(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    return vector / (np.linalg.norm(vector) + 1e-12)
+
+_cache = ResponseCache()
+
+def _is_follow_up(normalized: str) -> bool:
+    words = [word.strip(".,!?؟،:;\"'()") for word in normalized.split()]
+    words = [word for word in words if word]
+    if len(words) < RESPONSE_CACHE_MIN_WORDS:
+        return True
+    # "وهذا", "والثانية": the conjunction is part of the word in Arabic
+    return any(word in FOLLOW_UP_TERMS or (word.startswith('و') and word[1:] in FOLLOW_UP_TERMS) for word in words)
+
+def should_cache(message: str, session, history: list = None, summary: str = "") -> tuple:
+    """
+    Returns (cacheable?, reason). Profile-building and personal turns bypass
+    the cache, and so do follow-ups (short or referring back) once there is
+    a conversation for them to depend on.
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        return False, 'disabled'
+    if session is None or not session.is_complete():
+        return False, 'bypass_profile_building'
+    normalized = " ".join(normalize_arabic(message).split())
+    if _URL.search(normalized):
+        return False, 'bypass_url'
+    if any(normalized.startswith(intent) for intent in PROFILE_INTENTS) or any(term in normalized for term in PERSONAL_TERMS):
+        return False, 'bypass_personal'
+    if (history or summary) and _is_follow_up(normalized):
+        return False, 'bypass_follow_up'
+    return True, 'cacheable'
+
+async def lookup(message: str, session, history: list = None, summary: str = ""):
+    """
+    Return (cached response or None, key). key is None when the turn bypasses
+    the cache; otherwise pass it to store() once the answer is generated.
+    """
+    cacheable, reason = should_cache(message, session, history, summary)
+    if not cacheable:
+        if reason != 'disabled':
+            _count(reason)
+        return None, None
+    try:
+        # Served from the embedding cache for repeated questions
+        embedding = await run_blocking(embed_query, message)
+    except Exception as e:
+        print(f"Response cache lookup skipped, embedding failed: {e}")
+        return None, None
+    key = (session.fingerprint(), embedding, session.profile)
+    return _cache.get(key[0], embedding), key
+
+def _mentions_user(response: str, profile: dict) -> bool:
+    """True if the answer names the user or their site, so it can't be shared."""
+    name = (profile or {}).get('name')
+    domain = urlparse((profile or {}).get('website_url') or '').netloc.lower()
+    if domain.startswith('www.'):
+        domain = domain[4:]
+    lowered = response.lower()
+    return bool((name and name.lower() in lowered) or (domain and domain in lowered))
+
+def store(key, response: str):
+    if key is None or not response:
+        return
+    fingerprint, embedding, profile = key
+    if _mentions_user(response, profile):
+        _count('skipped_personal_answer')
+        return
+    _cache.put(fingerprint, embedding, response)
+
+def _count(reason: str):
+    with _cache._lock:
+        _cache._stats[reason] = _cache._stats.get(reason, 0) + 1
+
+def get_response_cache_stats() -> dict:
+    return _cache.stats()
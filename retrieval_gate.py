@@ -0,0 +1,128 @@
+# retrieval_gate.py
+import asyncio
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from arabic_text import normalize_arabic, tokenize
+from rag_retriever import retrieve_context, HYBRID_VECTOR_TIMEOUT
+from thread_pool import run_blocking
+
+# Messages shorter than this (characters) skip retrieval unless they carry an intent keyword
+RAG_MIN_QUERY_CHARS = int(os.getenv("RAG_MIN_QUERY_CHARS", "12"))
+# Retrieval taking longer than this (seconds) is abandoned and the answer goes
+# ahead without context. It must leave room for the vector search timeout plus
+# the lexical fallback and re-ranking, or the fallback never gets to answer.
+RAG_DEADLINE_MARGIN = float(os.getenv("RAG_DEADLINE_MARGIN", "1"))
+RAG_DEADLINE_SECONDS = float(os.getenv("RAG_DEADLINE_SECONDS", str(HYBRID_VECTOR_TIMEOUT + RAG_DEADLINE_MARGIN)))
+if RAG_DEADLINE_SECONDS < HYBRID_VECTOR_TIMEOUT + RAG_DEADLINE_MARGIN:
+    print(f"RAG_DEADLINE_SECONDS={RAG_DEADLINE_SECONDS} is shorter than HYBRID_VECTOR_TIMEOUT plus "
+          f"{RAG_DEADLINE_MARGIN}s; raising it so the lexical fallback can answer")
+    RAG_DEADLINE_SECONDS = HYBRID_VECTOR_TIMEOUT + RAG_DEADLINE_MARGIN
+# Term overlap (Jaccard) above which a recent query's context is reused
+RAG_REUSE_SIMILARITY = float(os.getenv("RAG_REUSE_SIMILARITY", "0.8"))
+# How long (seconds) a recent query's context may be reused
+RAG_REUSE_TTL = float(os.getenv("RAG_REUSE_TTL", "600"))
+RAG_RECENT_QUERIES = 256
+
+# Courtesies and acknowledgements that never need the archive (normalized form)
+SMALL_TALK = {
+    normalize_arabic(phrase) for phrase in [
+        "شكراً", "شكرا لك", "شكراً جزيلاً", "مشكور", "مرحبا", "مرحباً", "أهلاً", "اهلا وسهلا",
+        "السلام عليكم", "وعليكم السلام", "تمام", "ممتاز", "حسناً", "اوكي", "نعم", "لا", "مع السلامة",
+        "صباح الخير", "مساء الخير", "ok", "okay", "thanks", "thank you", "hi", "hello", "bye",
+    ]
+}
+
+# Questions answered entirely from the user's profile
+PROFILE_INTENTS = [
+    normalize_arabic(phrase) for phrase in [
+        "ما اسمي", "ماهو اسمي", "من أنا", "ما وظيفتي", "ما هي وظيفتي", "ما هي أهدافي", "ما أهدافي",
+        "ما هو موقعي", "what is my name", "who am i",
+    ]
+]
+
+# Terms that make even a short message worth a lookup
+INTENT_TERMS = set(tokenize(
+    "استراتيجية خطة تقرير تحليل سوق السوق منافسين أسعار تسعير ميزانية حملة إعلان محتوى "
+    "مبيعات عملاء نمو أرقام إحصائيات بيانات "
+    "strategy plan report analysis market competitors pricing budget campaign sales growth data"
+))
+
+_stats = Counter()
+_recent = OrderedDict()  # frozenset of terms -> (context, stored_at)
+_lock = threading.Lock()
+
+def should_retrieve(message: str):
+    """Cheap local decision: returns (retrieve?, reason)."""
+    normalized = " ".join(normalize_arabic(message).split()).strip(" .!؟?،,")
+    if normalized in SMALL_TALK:
+        return False, 'skipped_small_talk'
+    if any(normalized.startswith(intent) for intent in PROFILE_INTENTS):
+        return False, 'skipped_profile'
+    terms = set(tokenize(message))
+    if not terms:
+        return False, 'skipped_short'
+    if len(normalized) < RAG_MIN_QUERY_CHARS and not terms & INTENT_TERMS:
+        return False, 'skipped_short'
+    return True, 'retrieve'
+
+def _reusable_context(terms: frozenset):
+    now = time.monotonic()
+    with _lock:
+        for previous, (context, stored_at) in reversed(_recent.items()):
+            if now - stored_at > RAG_REUSE_TTL:
+                continue
+            overlap = len(terms & previous) / len(terms | previous)
+            if overlap >= RAG_REUSE_SIMILARITY:
+                _recent.move_to_end(previous)
+                return context
+    return None
+
+def _remember(terms: frozenset, context: str):
+    with _lock:
+        _recent[terms] = (context, time.monotonic())
+        _recent.move_to_end(terms)
+        while len(_recent) > RAG_RECENT_QUERIES:
+            _recent.popitem(last=False)
+
+def _count(path: str):
+    with _lock:
+        _stats[path] += 1
+
+async def gated_context(message: str) -> str:
+    """
+    Return RAG context for the message, or "" when retrieval is skipped,
+    fails, or misses its deadline.
+    """
+    retrieve, reason = should_retrieve(message)
+    if not retrieve:
+        _count(reason)
+        return ""
+
+    terms = frozenset(tokenize(message))
+    context = _reusable_context(terms)
+    if context is not None:
+        _count('reused')
+        return context
+
+    try:
+        # The worker thread is not interrupted on timeout; it finishes in the
+        # background and still warms the embedding cache.
+        context = await asyncio.wait_for(run_blocking(retrieve_context, message), timeout=RAG_DEADLINE_SECONDS)
+    except asyncio.TimeoutError:
+        print(f"RAG retrieval missed its {RAG_DEADLINE_SECONDS}s deadline; answering without context")
+        _count('timed_out')
+        return ""
+    except Exception as e:
+        print(f"RAG context retrieval failed: {e}")
+        _count('failed')
+        return ""
+
+    _count('retrieved')
+    _remember(terms, context)
+    return context
+
+def get_retrieval_stats() -> dict:
+    with _lock:
+        return dict(_stats)
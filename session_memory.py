@@ -1,16 +1,92 @@
 # session_memory.py
+import asyncio
+import os
 from collections import defaultdict
 
+# Messages (user + bot) kept verbatim; older ones are folded into the summary
+SUMMARY_KEEP_MESSAGES = int(os.getenv("SUMMARY_KEEP_MESSAGES", "6"))
+# Fold once a session holds more than this many verbatim messages
+SUMMARY_TRIGGER_MESSAGES = int(os.getenv("SUMMARY_TRIGGER_MESSAGES", "12"))
+# Hard cap if summarizing keeps failing; the oldest messages are dropped
+SESSION_MAX_MESSAGES = 4 * SUMMARY_TRIGGER_MESSAGES
+
 class SessionMemory:
-    def __init__(self):
+    """
+    Per-user chat memory: the most recent messages verbatim plus a rolling
+    summary of everything older.
+
+    summarizer is an async callable (previous_summary, messages) -> summary.
+    Folding runs as a background task after append(), so requests never wait
+    for it. Without a summarizer, old messages are simply dropped.
+    """
+
+    def __init__(self, summarizer=None, keep_recent: int = SUMMARY_KEEP_MESSAGES,
+                 trigger: int = SUMMARY_TRIGGER_MESSAGES):
+        # Keep whole user-bot pairs so roles stay aligned
+        self.keep_recent = keep_recent - keep_recent % 2
+        self.trigger = max(trigger, self.keep_recent)
+        self.summarizer = summarizer
         self.sessions = defaultdict(list)
+        self.summaries = {}
+        self._locks = defaultdict(asyncio.Lock)
+        self._generations = defaultdict(int)
+        self._tasks = set()
 
     def get_history(self, user_id: str) -> list[str]:
         return self.sessions[user_id]
 
+    def get_summary(self, user_id: str) -> str:
+        return self.summaries.get(user_id, "")
+
     def append(self, user_id: str, user_message: str, bot_response: str):
-        self.sessions[user_id].append(user_message)
-        self.sessions[user_id].append(bot_response)
+        history = self.sessions[user_id]
+        history.append(user_message)
+        history.append(bot_response)
+        if len(history) <= self.trigger:
+            return
+        if self.summarizer is None:
+            del history[:len(history) - self.keep_recent]
+            return
+        if len(history) > SESSION_MAX_MESSAGES and not self._locks[user_id].locked():
+            del history[:len(history) - SESSION_MAX_MESSAGES]
+        self._schedule_fold(user_id)
+
+    def _schedule_fold(self, user_id: str):
+        if self._locks[user_id].locked():
+            return  # a fold is already running; it will pick up new messages next time
+        try:
+            task = asyncio.get_running_loop().create_task(self._fold(user_id))
+        except RuntimeError:
+            return  # no event loop (e.g. called from a script); fold on a later append
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fold(self, user_id: str):
+        async with self._locks[user_id]:
+            history = self.sessions[user_id]
+            count = len(history) - self.keep_recent
+            if count <= 0:
+                return
+            generation = self._generations[user_id]
+            older = history[:count]
+            try:
+                summary = await self.summarizer(self.get_summary(user_id), older)
+            except Exception as e:
+                print(f"Conversation summary failed for {user_id}: {e}")
+                return
+            if self._generations[user_id] != generation:
+                return  # cleared while summarizing
+            # Messages appended meanwhile sit after the folded ones and are kept
+            del history[:count]
+            if summary:
+                self.summaries[user_id] = summary.strip()
 
     def clear(self, user_id: str):
+        self._generations[user_id] += 1
         self.sessions[user_id] = []
+        self.summaries.pop(user_id, None)
+
+    def shutdown(self):
+        """Cancel summaries still running in the background."""
+        for task in list(self._tasks):
+            task.cancel()
@@ -0,0 +1,284 @@
+# site_crawler.py
+import asyncio
+import os
+import re
+import time
+from collections import Counter, OrderedDict
+from urllib.parse import unquote, urljoin, urlsplit, urlunsplit
+from urllib.robotparser import RobotFileParser
+from lxml import etree
+from request_context import request_deadline, bounded_timeout
+from website_analyzer import analyze_website, fetch_cached_page, MAX_KEYWORDS
+
+# Inner pages analyzed besides the homepage (0 = homepage only)
+CRAWL_MAX_PAGES = int(os.getenv("CRAWL_MAX_PAGES", "4"))
+# Politeness: requests in flight per domain, and seconds between two request starts
+CRAWL_PER_DOMAIN_CONCURRENCY = int(os.getenv("CRAWL_PER_DOMAIN_CONCURRENCY", "2"))
+CRAWL_DELAY = float(os.getenv("CRAWL_DELAY", "0.25"))
+# Time allowed for the whole crawl (seconds), robots.txt and sitemap included
+CRAWL_TIME_BUDGET = float(os.getenv("CRAWL_TIME_BUDGET", "25"))
+# Longest Crawl-delay from robots.txt that is honoured; slower sites get fewer pages
+MAX_CRAWL_DELAY = 5.0
+MAX_SITEMAP_URLS = 500
+MAX_CHILD_SITEMAPS = 2
+# Domains whose politeness gate is remembered between crawls
+MAX_DOMAIN_GATES = 1024
+ROBOTS_AGENT = "MorvoBot"
+XML_TYPES = ('application/xml', 'text/xml', 'application/rss+xml', 'text/plain')
+
+# What makes a page worth reading, matched against its path and link text
+PAGE_CATEGORIES = {
+    'about': re.compile(r'about|who-?we-?are|company|story|team|من-?نحن|عن-?الشركة|قصتنا|فريق', re.IGNORECASE),
+    'services': re.compile(r'services?|solutions?|products?|what-?we-?do|خدمات|خدماتنا|حلول|منتجات', re.IGNORECASE),
+    'pricing': re.compile(r'pric|plans?|packages?|rates|أسعار|الاسعار|الأسعار|باقات|الباقات|اشتراك', re.IGNORECASE),
+    'contact': re.compile(r'contact|reach-?us|locations?|تواصل|اتصل|اتصال|فروع', re.IGNORECASE),
+}
+SKIP_EXTENSIONS = re.compile(r'\.(?:pdf|jpe?g|png|gif|svg|webp|zip|rar|mp4|mp3|docx?|xlsx?|pptx?|css|js|xml|json)$',
+                             re.IGNORECASE)
+
+_stats = Counter()
+_gates = OrderedDict()  # host -> DomainGate, touched only on the event loop
+
+def _host(url: str) -> str:
+    host = (urlsplit(url).hostname or '').lower()
+    return host[4:] if host.startswith('www.') else host
+
+def _canonical(url: str) -> str:
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path or '/', parts.query, ''))
+
+def _categorize(url: str, text: str = ''):
+    """(category, score) for a candidate page, or (None, 0) when it matches none."""
+    path = unquote(urlsplit(url).path)
+    best, best_score = None, 0
+    for category, pattern in PAGE_CATEGORIES.items():
+        score = (3 if pattern.search(path) else 0) + (2 if text and pattern.search(text) else 0)
+        if score > best_score:
+            best, best_score = category, score
+    if best:
+        # Prefer /about over /blog/2021/about-our-new-office
+        best_score -= 0.5 * max(path.strip('/').count('/'), 0)
+    return best, best_score
+
+def pick_pages(home_url: str, links: list, sitemap_urls: list, robots: RobotFileParser, limit: int) -> list[dict]:
+    """
+    Choose up to limit internal pages: one per category first (best score
+    wins), then the next best of any category. Links from the homepage count
+    their text as well as their path; sitemap entries only their path.
+    """
+    home = _canonical(home_url)
+    candidates = {}
+    for href, text in list(links) + [(url, '') for url in sitemap_urls]:
+        url = _canonical(urljoin(home_url, href))
+        if url == home or urlsplit(url).scheme not in ('http', 'https') or _host(url) != _host(home_url):
+            continue
+        if SKIP_EXTENSIONS.search(urlsplit(url).path):
+            continue
+        category, score = _categorize(url, text)
+        if category is None or url in candidates and candidates[url]['score'] >= score:
+            continue
+        if robots is not None and not robots.can_fetch(ROBOTS_AGENT, url):
+            _stats['robots_disallowed'] += 1
+            continue
+        candidates[url] = {'url': url, 'category': category, 'score': score}
+
+    ranked = sorted(candidates.values(), key=lambda c: -c['score'])
+    chosen = []
+    for category in PAGE_CATEGORIES:
+        best = next((c for c in ranked if c['category'] == category), None)
+        if best and len(chosen) < limit:
+            chosen.append(best)
+    for candidate in ranked:
+        if len(chosen) >= limit:
+            break
+        if candidate not in chosen:
+            chosen.append(candidate)
+    return chosen
+
+class DomainGate:
+    """Per-domain politeness: at most `concurrency` requests in flight, starts spaced by `delay` seconds."""
+
+    def __init__(self, concurrency: int, delay: float):
+        self.delay = delay
+        self._slots = asyncio.Semaphore(max(concurrency, 1))
+        self._lock = asyncio.Lock()
+        self._next_start = 0.0
+        self._users = 0
+
+    @property
+    def idle(self) -> bool:
+        return not self._users and time.monotonic() >= self._next_start
+
+    async def __aenter__(self):
+        self._users += 1
+        try:
+            await self._slots.acquire()
+        except BaseException:
+            self._users -= 1
+            raise
+        try:
+            async with self._lock:
+                wait = self._next_start - time.monotonic()
+                self._next_start = max(self._next_start, time.monotonic()) + self.delay
+            if wait > 0:
+                await asyncio.sleep(wait)
+        except BaseException:
+            await self.__aexit__()
+            raise
+
+    async def __aexit__(self, *exc):
+        self._slots.release()
+        self._users -= 1
+
+def domain_gate(url: str) -> DomainGate:
+    """
+    The process-wide gate of url's host, so concurrent crawls of one site
+    (onboarding and /analyze-website, or many users entering the same
+    domain) share its limits instead of each getting their own.
+    """
+    host = _host(url)
+    gate = _gates.get(host)
+    if gate is None:
+        gate = _gates[host] = DomainGate(CRAWL_PER_DOMAIN_CONCURRENCY, CRAWL_DELAY)
+        # Forget the least recently crawled hosts, unless a crawl is still using them
+        for old_host in list(_gates)[:max(len(_gates) - MAX_DOMAIN_GATES, 0)]:
+            if _gates[old_host].idle:
+                del _gates[old_host]
+    _gates.move_to_end(host)
+    return gate
+
+async def _fetch_text(url: str, gate: DomainGate, content_types: tuple) -> str:
+    """robots.txt or a sitemap, through the page cache like the pages themselves."""
+    return await fetch_cached_page(url, early_stop=False, content_types=content_types, limiter=gate)
+
+async def _read_robots(home_url: str, gate: DomainGate) -> RobotFileParser:
+    """Parsed robots.txt; a missing or unreadable file allows everything."""
+    robots = RobotFileParser()
+    try:
+        robots.parse((await _fetch_text(urljoin(home_url, '/robots.txt'), gate, XML_TYPES)).splitlines())
+    except Exception as e:
+        print(f"No robots.txt for {home_url}: {e}")
+        robots.parse([])
+    return robots
+
+def _sitemap_locations(text: str) -> tuple[list, list]:
+    """(page URLs, child sitemap URLs) listed in a sitemap or sitemap index."""
+    try:
+        root = etree.fromstring(text.encode('utf-8'), parser=etree.XMLParser(recover=True, resolve_entities=False,
+                                                                             no_network=True))
+    except etree.XMLSyntaxError:
+        return [], []
+    if root is None:
+        return [], []
+    pages, children = [], []
+    for loc in root.iter('{*}loc'):
+        if not loc.text:
+            continue
+        parent = etree.QName(loc.getparent()).localname if loc.getparent() is not None else ''
+        (children if parent == 'sitemap' else pages).append(loc.text.strip())
+    return pages[:MAX_SITEMAP_URLS], children
+
+async def _read_sitemaps(home_url: str, robots: RobotFileParser, gate: DomainGate) -> list[str]:
+    """Page URLs from the sitemaps named in robots.txt, or /sitemap.xml, following a sitemap index one level."""
+    queue = list(robots.site_maps() or []) or [urljoin(home_url, '/sitemap.xml')]
+    urls = []
+    fetched = 0
+    while queue and fetched <= MAX_CHILD_SITEMAPS and len(urls) < MAX_SITEMAP_URLS:
+        sitemap_url = queue.pop(0)
+        if _host(sitemap_url) != _host(home_url):
+            continue
+        fetched += 1
+        try:
+            text = await _fetch_text(sitemap_url, gate, XML_TYPES)
+        except Exception as e:
+            print(f"Sitemap {sitemap_url} skipped: {e}")
+            continue
+        pages, children = _sitemap_locations(text)
+        urls.extend(pages)
+        queue.extend(children[:MAX_CHILD_SITEMAPS])
+    _stats['sitemap_urls'] += len(urls)
+    return urls[:MAX_SITEMAP_URLS]
+
+async def _analyze_inner_page(candidate: dict, gate: DomainGate) -> dict:
+    data = await analyze_website(candidate['url'], limiter=gate)
+    if data.get('status') != 'success':
+        _stats['page_errors'] += 1
+        return None
+    _stats['pages_fetched'] += 1
+    return {
+        'url': candidate['url'],
+        'category': candidate['category'],
+        'title': data['title'],
+        'headings': data.get('headings', [])[:5],
+        'keywords': data.get('keywords', []),
+        'content_preview': data['content_preview'],
+    }
+
+def merge_site(home: dict, pages: list[dict]) -> dict:
+    """One site summary: the homepage fields, the inner pages, and keywords from all of them."""
+    merged = {key: value for key, value in home.items() if key != 'links'}
+    merged['pages'] = [{key: page[key] for key in ('url', 'category', 'title', 'content_preview')} for page in pages]
+    keywords = list(home.get('keywords') or [])
+    for page in pages:
+        keywords.extend(k for k in page['keywords'] if k not in keywords)
+    merged['keywords'] = keywords[:MAX_KEYWORDS]
+    merged['headings'] = list(home.get('headings') or [])
+    for page in pages:
+        merged['headings'].extend(h for h in page['headings'] if h not in merged['headings'])
+    return merged
+
+async def crawl_site(url: str, max_pages: int = CRAWL_MAX_PAGES) -> dict:
+    """
+    Analyze a site beyond its homepage. Reads robots.txt and the sitemap,
+    picks up to max_pages relevant internal pages (about, services, pricing,
+    contact) from the homepage links and sitemap, and fetches them
+    concurrently within the per-domain politeness limits and the crawl time
+    budget. Returns the homepage's analyze_website result with the inner
+    pages merged in; pages that miss the budget are left out.
+    """
+    if max_pages <= 0:
+        return await analyze_website(url)
+    started = time.monotonic()
+    _stats['crawls'] += 1
+
+    budget = bounded_timeout(CRAWL_TIME_BUDGET)
+    with request_deadline(budget):
+        home = await analyze_website(url, include_links=True)
+        if home.get('status') != 'success':
+            return home
+
+        gate = domain_gate(home['url'])
+        try:
+            robots = await _read_robots(home['url'], gate)
+            gate.delay = max(gate.delay, min(float(robots.crawl_delay(ROBOTS_AGENT) or 0), MAX_CRAWL_DELAY))
+            sitemap_urls = await _read_sitemaps(home['url'], robots, gate)
+        except Exception as e:
+            print(f"Crawl discovery failed for {url}: {e}")
+            robots, sitemap_urls = None, []
+
+        chosen = pick_pages(home['url'], home.get('links') or [], sitemap_urls, robots, max_pages)
+        print(f"Crawling {len(chosen)} pages of {home['domain']}: {[c['url'] for c in chosen]}")  # Debug log
+        tasks = [asyncio.create_task(_analyze_inner_page(candidate, gate)) for candidate in chosen]
+        pages = []
+        if tasks:
+            left = budget - (time.monotonic() - started)
+            done, pending = await asyncio.wait(tasks, timeout=max(left, 0))
+            for task in pending:
+                task.cancel()
+            if pending:
+                _stats['budget_exhausted'] += 1
+                _stats['pages_dropped'] += len(pending)
+            # Keep the chosen order, so the report lists pages the same way each time
+            pages = [task.result() for task in tasks
+                     if task in done and not task.cancelled() and task.exception() is None and task.result()]
+
+    _stats['seconds'] += time.monotonic() - started
+    return merge_site(home, pages)
+
+def get_crawler_stats() -> dict:
+    crawls = _stats['crawls']
+    return {
+        **_stats,
+        'seconds': round(_stats['seconds'], 3),
+        'mean_seconds': round(_stats['seconds'] / crawls, 3) if crawls else 0.0,
+    }
@@ -369,6 +369,10 @@ def call_api(endpoint, data=None):
             
         if response.status_code == 200:
             return response.json()
+        elif response.status_code == 429:
+            # Server is at capacity; it says when to come back
+            st.warning(response.json().get("response", "الخادم مشغول حالياً. يرجى المحاولة بعد قليل."))
+            return None
         else:
             st.error(f"خطأ في الاتصال: {response.status_code}")
             if not IS_LOCAL:
@@ -391,6 +395,36 @@ def call_api(endpoint, data=None):
         st.error(f"خطأ غير متوقع: {str(e)}")
         return None
 
+def stream_api(endpoint, data):
+    """Call a Server-Sent Events endpoint and yield (event, payload) pairs as they arrive"""
+    try:
+        # Short connect timeout; the read timeout applies between streamed chunks
+        with requests.post(f"{API_BASE}{endpoint}", json=data, stream=True, timeout=(10, 120)) as response:
+            if response.status_code != 200:
+                st.error(f"خطأ في الاتصال: {response.status_code}")
+                return
+            
+            response.encoding = "utf-8"
+            event = "message"
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    event = "message"
+                elif line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    yield event, json.loads(line[len("data:"):].strip())
+    
+    except requests.exceptions.ConnectionError:
+        st.error("لا يمكن الاتصال بالخادم")
+        if not IS_LOCAL:
+            st.info("الخادم يحتاج إلى وقت للتشغيل (30-60 ثانية). يرجى الانتظار وإعادة المحاولة.")
+    
+    except requests.exceptions.Timeout:
+        st.error("انتهت مهلة الاتصال")
+    
+    except Exception as e:
+        st.error(f"خطأ غير متوقع: {str(e)}")
+
 def get_user_profile_status(user_id):
     """Get user profile status"""
     return call_api(f"/profile/{user_id}")
@@ -490,6 +524,9 @@ def main():
             else:
                 st.info("👋 مرحباً! أنا مورفو، مساعدك التسويقي الذكي. دعني أتعرف عليك أولاً!")
         
+        # Live area where the answer is rendered while it streams in
+        stream_placeholder = st.empty()
+        
         # Chat input with better styling
         col1, col2 = st.columns([4, 1])
         with col1:
@@ -501,28 +538,44 @@ def main():
                     # Add user message
                     st.session_state.messages.append({"role": "user", "content": user_input})
                     
-                    # Show loading
-                    with st.spinner("جاري التفكير..."):
-                        # Call API
-                        response = call_api("/chat", {
+                    # Stream the answer token by token
+                    user_html = f'<div class="chat-message user-message arabic-text"><strong>👤 أنت:</strong> {user_input}</div>'
+                    stream_placeholder.markdown(user_html, unsafe_allow_html=True)
+                    bot_response = ""
+                    response = None
+                    if st.session_state.user_id:
+                        for event, payload in stream_api("/chat/stream", {
                             "user_id": st.session_state.user_id,
                             "message": user_input
-                        }) if st.session_state.user_id else None
+                        }):
+                            if event == "delta":
+                                bot_response += payload.get("text", "")
+                                stream_placeholder.markdown(
+                                    user_html + f'<div class="chat-message bot-message arabic-text"><strong>🤖 مورفو:</strong> {bot_response}</div>',
+                                    unsafe_allow_html=True
+                                )
+                            elif event == "done":
+                                response = payload
+                            elif event == "error":
+                                bot_response = payload.get("error", "عذراً، حدث خطأ في الاستجابة")
+                    
+                    if response:
+                        bot_response = response.get("response", bot_response)
+                        st.session_state.messages.append({"role": "assistant", "content": bot_response})
+                        st.session_state.chat_count += 1
                         
-                        if response:
-                            bot_response = response.get("response", "عذراً، حدث خطأ في الاستجابة")
-                            st.session_state.messages.append({"role": "assistant", "content": bot_response})
-                            st.session_state.chat_count += 1
-                            
-                            # Check if profile is complete
-                            profile_complete = response.get("profile_complete", False)
-                            if profile_complete:
-                                st.success("🎉 تم إكمال ملفك الشخصي! الآن يمكنني مساعدتك بشكل أفضل.")
-                            else:
-                                st.success("تم إرسال الرسالة بنجاح!")
+                        # Check if profile is complete
+                        profile_complete = response.get("profile_complete", False)
+                        if profile_complete:
+                            st.success("🎉 تم إكمال ملفك الشخصي! الآن يمكنني مساعدتك بشكل أفضل.")
                         else:
-                            st.session_state.messages.append({"role": "assistant", "content": "عذراً، لا يمكن الاتصال بالخادم. تأكد من تشغيل الخادم."})
-                            st.error("خطأ في الاتصال بالخادم")
+                            st.success("تم إرسال الرسالة بنجاح!")
+                    elif bot_response:
+                        st.session_state.messages.append({"role": "assistant", "content": bot_response})
+                        st.error("خطأ في الاتصال بالخادم")
+                    else:
+                        st.session_state.messages.append({"role": "assistant", "content": "عذراً، لا يمكن الاتصال بالخادم. تأكد من تشغيل الخادم."})
+                        st.error("خطأ في الاتصال بالخادم")
                     
                     st.rerun()
                 else:
@@ -599,7 +652,7 @@ def main():
                                     <h4>📝 العنوان</h4>
                                     <p>{website_data.get('title', 'غير متوفر')}</p>
                                     <h4>🏷️ الكلمات المفتاحية</h4>
-                                    <p>{website_data.get('keywords', 'غير متوفر')}</p>
+                                    <p>{'، '.join(website_data.get('keywords') or []) or 'غير متوفر'}</p>
                                 </div>
                                 ''', unsafe_allow_html=True)
                             
@@ -0,0 +1,28 @@
+# thread_pool.py
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Upper bound on threads used for blocking work (SQLite, Chroma, HTML parsing)
+BLOCKING_POOL_SIZE = int(os.getenv("BLOCKING_POOL_SIZE", "16"))
+# Threads for the vector side of hybrid retrieval. Each retrieval runs on the
+# blocking pool and waits on one vector search, so matching its size keeps
+# queueing rare; a search that times out still holds its thread until it
+# returns, so a slow embedding API can back this pool up.
+VECTOR_POOL_SIZE = int(os.getenv("VECTOR_POOL_SIZE", str(BLOCKING_POOL_SIZE)))
+
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_POOL_SIZE, thread_name_prefix="morvo-io")
+vector_executor = ThreadPoolExecutor(max_workers=VECTOR_POOL_SIZE, thread_name_prefix="morvo-vector")
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run a blocking call on the shared, bounded thread pool so it never stalls
+    the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
+    vector_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,42 @@
+# token_count.py
+import threading
+import tiktoken
+
+ENCODING_NAME = "cl100k_base"
+
+_encoding = None
+_lock = threading.Lock()
+
+def get_encoding():
+    """Return the shared tiktoken encoding, or None if it cannot be loaded (e.g. offline)."""
+    global _encoding
+    if _encoding is None:
+        with _lock:
+            if _encoding is None:
+                try:
+                    _encoding = tiktoken.get_encoding(ENCODING_NAME)
+                except Exception as e:
+                    print(f"tiktoken unavailable, estimating token counts: {e}")
+                    _encoding = False
+    return _encoding or None
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is None:
+        # Rough estimate: ~4 characters per token
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut text down to at most max_tokens tokens."""
+    if max_tokens <= 0 or not text:
+        return ""
+    encoding = get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
@@ -2,10 +2,111 @@
 import sqlite3
 import os
 from datetime import datetime
+import hashlib
 import json
+import sys
+import threading
+from collections import OrderedDict
 
 DB_FILE = os.getenv("DB_FILE", "user_profiles.db")
 
+# In-process profile cache bounds (entries and approximate bytes)
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "1024"))
+PROFILE_CACHE_MAX_BYTES = int(os.getenv("PROFILE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# Compact business digest distilled once from the website at onboarding;
+# list fields are stored as JSON arrays
+DIGEST_FIELDS = ['industry', 'offering', 'audience', 'weaknesses', 'keywords']
+DIGEST_LIST_FIELDS = {'weaknesses', 'keywords'}
+
+PROFILE_FIELDS = ['name', 'business_type', 'goals', 'website_url',
+                  'website_analysis', 'conversation_stage', *DIGEST_FIELDS]
+
+PROFILE_COLUMNS = ['user_id', 'name', 'business_type', 'goals', 'website_url',
+                   'website_analysis', 'created_at', 'updated_at', 'conversation_stage',
+                   *DIGEST_FIELDS]
+
+_conn = None
+_conn_lock = threading.RLock()
+
+def _get_connection():
+    """Return the process-wide SQLite connection, opening it on first use."""
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+        _conn.row_factory = sqlite3.Row
+    return _conn
+
+# user_id -> (profile dict, approximate size in bytes), least recently used first
+_profile_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_bytes = 0
+_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+def _profile_size(profile: dict) -> int:
+    return sys.getsizeof(profile) + sum(sys.getsizeof(value) for value in profile.values())
+
+def _cache_get(user_id: str):
+    with _cache_lock:
+        entry = _profile_cache.get(user_id)
+        if entry is None:
+            _cache_stats['misses'] += 1
+            return None
+        _profile_cache.move_to_end(user_id)
+        _cache_stats['hits'] += 1
+        return dict(entry[0])
+
+def _cache_store_locked(user_id: str, profile: dict):
+    global _cache_bytes
+    size = _profile_size(profile)
+    old = _profile_cache.pop(user_id, None)
+    if old is not None:
+        _cache_bytes -= old[1]
+    if size > PROFILE_CACHE_MAX_BYTES or PROFILE_CACHE_MAX_ENTRIES <= 0:
+        return
+    _profile_cache[user_id] = (profile, size)
+    _cache_bytes += size
+    while (len(_profile_cache) > PROFILE_CACHE_MAX_ENTRIES
+           or _cache_bytes > PROFILE_CACHE_MAX_BYTES):
+        _, (_, evicted_size) = _profile_cache.popitem(last=False)
+        _cache_bytes -= evicted_size
+        _cache_stats['evictions'] += 1
+
+def _cache_put(user_id: str, profile: dict):
+    with _cache_lock:
+        _cache_store_locked(user_id, dict(profile))
+
+def _cache_merge(user_id: str, fields: dict):
+    """Apply a write to the cached row, if there is one."""
+    with _cache_lock:
+        entry = _profile_cache.get(user_id)
+        if entry is not None:
+            _cache_store_locked(user_id, {**entry[0], **fields})
+
+def invalidate_profile_cache(user_id: str = None):
+    """Drop one user's cached profile, or the whole cache when user_id is None."""
+    global _cache_bytes
+    with _cache_lock:
+        if user_id is None:
+            _profile_cache.clear()
+            _cache_bytes = 0
+            return
+        entry = _profile_cache.pop(user_id, None)
+        if entry is not None:
+            _cache_bytes -= entry[1]
+
+def get_profile_cache_stats() -> dict:
+    with _cache_lock:
+        lookups = _cache_stats['hits'] + _cache_stats['misses']
+        return {
+            **_cache_stats,
+            'entries': len(_profile_cache),
+            'bytes': _cache_bytes,
+            'max_entries': PROFILE_CACHE_MAX_ENTRIES,
+            'max_bytes': PROFILE_CACHE_MAX_BYTES,
+            'hit_rate': _cache_stats['hits'] / lookups if lookups else 0.0,
+        }
+
 def _ensure_columns(cursor):
     """Ensure required columns exist on the user_profiles table (idempotent)."""
     cursor.execute("PRAGMA table_info(user_profiles)")
@@ -13,7 +114,8 @@ def _ensure_columns(cursor):
     required_columns = [
         ('website_url', "TEXT"),
         ('website_analysis', "TEXT"),
-        ('conversation_stage', "TEXT DEFAULT 'greeting'")
+        ('conversation_stage', "TEXT DEFAULT 'greeting'"),
+        *((field, "TEXT") for field in DIGEST_FIELDS),
     ]
     for column_name, column_type in required_columns:
         if column_name not in existing_columns:
@@ -21,94 +123,125 @@ def _ensure_columns(cursor):
 
 # Create user profile table and run lightweight migration
 def init_user_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS user_profiles (
-            user_id TEXT PRIMARY KEY,
-            name TEXT,
-            business_type TEXT,
-            goals TEXT,
-            website_url TEXT,
-            website_analysis TEXT,
-            created_at TEXT,
-            updated_at TEXT,
-            conversation_stage TEXT DEFAULT 'greeting'
-        )
-    """)
-    # Ensure new columns exist for older databases (idempotent migration)
-    _ensure_columns(c)
-    conn.commit()
-    conn.close()
-
-# Get user profile
+    with _conn_lock:
+        conn = _get_connection()
+        c = conn.cursor()
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS user_profiles (
+                user_id TEXT PRIMARY KEY,
+                name TEXT,
+                business_type TEXT,
+                goals TEXT,
+                website_url TEXT,
+                website_analysis TEXT,
+                created_at TEXT,
+                updated_at TEXT,
+                conversation_stage TEXT DEFAULT 'greeting',
+                industry TEXT,
+                offering TEXT,
+                audience TEXT,
+                weaknesses TEXT,
+                keywords TEXT
+            )
+        """)
+        # Ensure new columns exist for older databases (idempotent migration)
+        _ensure_columns(c)
+        conn.commit()
+
+# Get user profile (served from the in-process cache when possible)
 def get_user_profile(user_id: str) -> dict:
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT * FROM user_profiles WHERE user_id = ?", (user_id,))
-    result = c.fetchone()
-    
-    if result:
-        columns = [description[0] for description in c.description]
-        data = dict(zip(columns, result))
-        conn.close()
-        return data
-    conn.close()
-    return None
+    cached = _cache_get(user_id)
+    if cached is not None:
+        return cached
+    # Filled under the connection lock, so a write can't land between the
+    # read and the fill and leave the older row cached
+    with _conn_lock:
+        row = _get_connection().execute(
+            "SELECT * FROM user_profiles WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if not row:
+            return None
+        profile = dict(row)
+        _cache_put(user_id, profile)
+    return profile
+
+def _upsert_profile(user_id: str, fields: dict) -> str:
+    """Insert or update a profile row in a single statement; returns the write timestamp."""
+    now = datetime.utcnow().isoformat()
+    columns = ['user_id', 'created_at', 'updated_at', *fields]
+    assignments = ', '.join(f"{key} = excluded.{key}" for key in [*fields, 'updated_at'])
+    sql = f"""
+        INSERT INTO user_profiles ({', '.join(columns)})
+        VALUES ({', '.join('?' for _ in columns)})
+        ON CONFLICT(user_id) DO UPDATE SET {assignments}
+    """
+    params = (user_id, now, now, *fields.values())
+    with _conn_lock:
+        conn = _get_connection()
+        try:
+            conn.execute(sql, params)
+        except sqlite3.OperationalError as e:
+            # If a column is missing (older DB), add it and retry once
+            if 'no such column' in str(e) or 'has no column' in str(e):
+                _ensure_columns(conn.cursor())
+                conn.execute(sql, params)
+            else:
+                raise
+        conn.commit()
+        # Write through to the cache so readers never see a stale row
+        _cache_merge(user_id, {**fields, 'updated_at': now})
+    return now
 
 # Update user profile
 def update_user_profile(user_id: str, **kwargs):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    # Get existing profile
-    existing = get_user_profile(user_id)
-    if not existing:
-        # Create new profile
-        c.execute("""
-            INSERT INTO user_profiles (user_id, created_at, updated_at)
-            VALUES (?, ?, ?)
-        """, (user_id, datetime.utcnow().isoformat(), datetime.utcnow().isoformat()))
-    
-    # Update fields
-    for key, value in kwargs.items():
-        if key in ['name', 'business_type', 'goals', 'website_url', 
-                   'website_analysis', 'conversation_stage']:
+    fields = {key: value for key, value in kwargs.items() if key in PROFILE_FIELDS}
+    _upsert_profile(user_id, fields)
+
+def digest_columns(digest: dict) -> dict:
+    """Convert a profile digest into column values (lists as JSON arrays)."""
+    columns = {}
+    for field in DIGEST_FIELDS:
+        value = digest.get(field)
+        if field in DIGEST_LIST_FIELDS:
+            columns[field] = json.dumps(list(value or []), ensure_ascii=False)
+        else:
+            columns[field] = value or None
+    return columns
+
+def get_profile_digest(profile: dict) -> dict:
+    """Read the digest back from a profile row; empty when there is none."""
+    if not profile:
+        return {}
+    digest = {}
+    for field in DIGEST_FIELDS:
+        value = profile.get(field)
+        if not value:
+            continue
+        if field in DIGEST_LIST_FIELDS:
             try:
-                c.execute(f"""
-                    UPDATE user_profiles 
-                    SET {key} = ?, updated_at = ?
-                    WHERE user_id = ?
-                """, (value, datetime.utcnow().isoformat(), user_id))
-            except sqlite3.OperationalError as e:
-                # If a column is missing (older DB), add it and retry once
-                if 'no such column' in str(e):
-                    _ensure_columns(c)
-                    c.execute(f"""
-                        UPDATE user_profiles 
-                        SET {key} = ?, updated_at = ?
-                        WHERE user_id = ?
-                    """, (value, datetime.utcnow().isoformat(), user_id))
-                else:
-                    raise
-    
-    conn.commit()
-    conn.close()
+                value = json.loads(value)
+            except (TypeError, ValueError):
+                value = [value]
+            if not value:
+                continue
+        digest[field] = value
+    return digest
 
-# Get conversation stage
-def get_conversation_stage(user_id: str) -> str:
-    profile = get_user_profile(user_id)
+def _stage_of(profile: dict) -> str:
     return profile.get('conversation_stage', 'greeting') if profile else 'greeting'
 
-# Update conversation stage
-def update_conversation_stage(user_id: str, stage: str):
-    update_user_profile(user_id, conversation_stage=stage)
+def _is_complete(profile: dict) -> bool:
+    if not profile:
+        return False
+
+    # Require 4 essential fields including website
+    required_fields = ['name', 'business_type', 'goals', 'website_url']
+
+    return all(profile.get(field) for field in required_fields)
+
+def _question_for(profile: dict) -> str:
+    stage = _stage_of(profile)
 
-# Get next question based on stage
-def get_next_question(user_id: str) -> str:
-    stage = get_conversation_stage(user_id)
-    profile = get_user_profile(user_id)
-    
     questions = {
         'greeting': "مرحباً! أنا مورفو، مساعدك التسويقي الذكي. ما اسمك؟",
         'name': "أهلاً وسهلاً {name}! ما هي وظيفتك أو دورك في الشركة؟".format(name=profile.get('name', '') if profile else ''),
@@ -116,26 +249,13 @@ def get_next_question(user_id: str) -> str:
         'goals': "شكراً لك! الآن أريد رابط موقع شركتك الإلكتروني لأحلل معلومات الشركة وأساعدك بشكل أفضل.",
         'complete': "ممتاز! تم تحليل موقع شركتك. الآن يمكنني مساعدتك في التسويق بناءً على معلومات شركتك. كيف يمكنني مساعدتك اليوم؟"
     }
-    
-    return questions.get(stage, "كيف يمكنني مساعدتك اليوم؟")
 
-# Check if profile is complete
-def is_profile_complete(user_id: str) -> bool:
-    profile = get_user_profile(user_id)
-    if not profile:
-        return False
-    
-    # Require 4 essential fields including website
-    required_fields = ['name', 'business_type', 'goals', 'website_url']
-    
-    return all(profile.get(field) for field in required_fields)
+    return questions.get(stage, "كيف يمكنني مساعدتك اليوم؟")
 
-# Get profile summary for LLM
-def get_profile_summary(user_id: str) -> str:
-    profile = get_user_profile(user_id)
-    if not profile or not is_profile_complete(user_id):
+def _summary_of(profile: dict, include_analysis: bool = True) -> str:
+    if not _is_complete(profile):
         return ""
-    
+
     summary = f"""
     معلومات المستخدم الأساسية:
     - الاسم: {profile.get('name', 'غير محدد')}
@@ -143,12 +263,114 @@ def get_profile_summary(user_id: str) -> str:
     - الأهداف التسويقية: {profile.get('goals', 'غير محدد')}
     - موقع الشركة: {profile.get('website_url', 'غير محدد')}
     """
-    
-    # Add website analysis if available
-    if profile.get('website_analysis'):
+
+    digest = get_profile_digest(profile)
+    labels = {
+        'industry': 'الصناعة',
+        'offering': 'ما تقدمه الشركة',
+        'audience': 'الجمهور المستهدف',
+        'weaknesses': 'أبرز نقاط الضعف',
+        'keywords': 'الكلمات المفتاحية',
+    }
+    for field, label in labels.items():
+        if field in digest:
+            value = digest[field]
+            if isinstance(value, list):
+                value = '، '.join(str(item) for item in value)
+            summary += f"- {label}: {value}\n    "
+
+    # The full report is for display; prompts use the digest when there is one
+    if include_analysis and not digest and profile.get('website_analysis'):
         summary += f"\nتحليل الموقع:\n{profile.get('website_analysis')}"
-    
+
     return summary
 
+def profile_fingerprint(profile: dict) -> str:
+    """
+    Short hash of the profile fields that shape generic answers (business
+    type and goals), so users with the same context can share cached replies.
+    """
+    parts = [' '.join(str((profile or {}).get(field) or '').casefold().split())
+             for field in ('business_type', 'goals')]
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+# Get conversation stage
+def get_conversation_stage(user_id: str) -> str:
+    return _stage_of(get_user_profile(user_id))
+
+# Update conversation stage
+def update_conversation_stage(user_id: str, stage: str):
+    update_user_profile(user_id, conversation_stage=stage)
+
+# Get next question based on stage
+def get_next_question(user_id: str) -> str:
+    return _question_for(get_user_profile(user_id))
+
+# Check if profile is complete
+def is_profile_complete(user_id: str) -> bool:
+    return _is_complete(get_user_profile(user_id))
+
+# Get profile summary for LLM
+def get_profile_summary(user_id: str) -> str:
+    return _summary_of(get_user_profile(user_id))
+
+class ProfileSession:
+    """
+    Request-scoped snapshot of one user's profile.
+
+    The row is read once when the session is created; updates are applied to
+    the snapshot immediately and written back as a single UPSERT on commit().
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.profile = get_user_profile(user_id)
+        self._pending = {}
+
+    @property
+    def stage(self) -> str:
+        return _stage_of(self.profile)
+
+    def is_complete(self) -> bool:
+        return _is_complete(self.profile)
+
+    def next_question(self) -> str:
+        return _question_for(self.profile)
+
+    def summary(self, include_analysis: bool = True) -> str:
+        return _summary_of(self.profile, include_analysis)
+
+    def fingerprint(self) -> str:
+        return profile_fingerprint(self.profile)
+
+    def analysis(self) -> str:
+        """
+        Website analysis report of a completed profile for the prompt, or ""
+        when the profile already has a digest (the report is then display-only).
+        """
+        if not _is_complete(self.profile) or get_profile_digest(self.profile):
+            return ""
+        return self.profile.get('website_analysis') or ""
+
+    def update(self, **kwargs):
+        fields = {key: value for key, value in kwargs.items() if key in PROFILE_FIELDS}
+        if self.profile is None:
+            self.profile = dict.fromkeys(PROFILE_COLUMNS)
+            self.profile.update(user_id=self.user_id, conversation_stage='greeting')
+        self.profile.update(fields)
+        self._pending.update(fields)
+
+    def commit(self):
+        if not self._pending:
+            return
+        now = _upsert_profile(self.user_id, self._pending)
+        self.profile['updated_at'] = now
+        if not self.profile.get('created_at'):
+            self.profile['created_at'] = now
+        # _upsert_profile already merged the written fields into the cache.
+        # The rest of this snapshot may be older than what other requests
+        # have written since, so it is not cached.
+        self._pending = {}
+
 # Initialize database on import
 init_user_db()
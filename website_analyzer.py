@@ -1,100 +1,145 @@
 # website_analyzer.py
-import requests
-from bs4 import BeautifulSoup
+import contextlib
+import httpx
 import re
+import time
+from collections import Counter
 from urllib.parse import urlparse
-import os
 from dotenv import load_dotenv
-from openai import OpenAI
-import urllib3
-
-# Disable SSL warnings
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from llm_provider import chat_completion, LLMError
+from admission import Overloaded
+from thread_pool import run_blocking
+from page_cache import page_cache, conditional_headers
+from http_fetcher import fetch_page, FetchError, HTML_TYPES
+from report_cache import report_cache, report_key
+from model_router import route, record_latency
+from arabic_text import tokenize
+from html_extract import extract_page
 
 load_dotenv()
-_client = None
 
-def get_client():
-    global _client
-    if _client is None:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY environment variable is not set")
-        _client = OpenAI(api_key=api_key)
-    return _client
+# Keywords shown for a site (meta keywords, or the most frequent terms)
+MAX_KEYWORDS = 8
+# Page headings passed to the report prompt
+MAX_REPORT_HEADINGS = 8
+# How crawled page categories are named in the report prompt
+PAGE_LABELS = {'about': 'من نحن', 'services': 'الخدمات', 'pricing': 'الأسعار', 'contact': 'التواصل'}
+
+def _extract_page_fields(html: str, include_links: bool = False) -> dict:
+    """Parse the page and pull out title, description, keywords, headings and a content preview."""
+    page = extract_page(html)
+    opengraph = page['opengraph']
+    organization = page['organization']
+
+    # Fall back to OpenGraph and JSON-LD data when the plain tags are missing
+    title = page['title'] or opengraph.get('title') or organization.get('name') or "No title found"
+    description = (page['description'] or opengraph.get('description')
+                   or organization.get('description') or "No description found")
+    content = page['main_text'] or "Could not extract content"
+
+    # Extract keywords: declared meta keywords, else the most frequent terms
+    keywords = page['keywords']
+    if not keywords:
+        text = ' '.join([part for part in (title, description) if not part.startswith('No ')]
+                        + page['headings'] + [page['main_text']])
+        # Count normalized terms, but show each one as it was first written
+        counts = Counter()
+        surface = {}
+        for word in re.findall(r'\w+', text):
+            terms = tokenize(word)
+            if len(terms) != 1 or len(terms[0]) <= 2 or terms[0].isdigit():
+                continue
+            counts[terms[0]] += 1
+            surface.setdefault(terms[0], word)
+        keywords = [surface[term] for term, _ in counts.most_common(MAX_KEYWORDS)]
+
+    fields = {
+        'title': title,
+        'description': description,
+        'keywords': keywords[:MAX_KEYWORDS],
+        'headings': page['headings'],
+        'site_name': opengraph.get('site_name') or organization.get('name', ''),
+        'organization': organization,
+        'content_preview': content[:300] + '...' if len(content) > 300 else content,
+    }
+    if include_links:
+        fields['links'] = page['links']
+    return fields
+
+async def fetch_cached_page(url: str, early_stop: bool = True, content_types: tuple = HTML_TYPES,
+                            limiter=None) -> str:
+    """
+    Page text, from the page cache while fresh. A stale copy is revalidated
+    with a conditional GET, so an unchanged page costs only a 304. limiter,
+    an async context manager such as the crawler's per-domain gate, is held
+    only around the network request, so cache hits don't wait for it.
+    """
+    cached = await run_blocking(page_cache.get, url)
+    if cached and not cached['complete'] and not early_stop:
+        cached = None  # a partial copy lacks what a full read is for
+    if cached and cached['fresh']:
+        print(f"Page cache hit: {url}")  # Debug log
+        return cached['body']
+
+    print(f"Fetching URL: {url}")  # Debug log
+    async with limiter or contextlib.nullcontext():
+        response = await fetch_page(url, conditional_headers(cached), content_types, early_stop)
+    if response['stopped']:
+        print(f"Stopped reading {url} early: {response['stopped']}")  # Debug log
 
-def analyze_website(url: str) -> dict:
+    if response['status_code'] == 304 and cached:
+        print(f"Page not modified: {url}")  # Debug log
+        await run_blocking(page_cache.refresh, url, response['headers'].get('ETag'),
+                           response['headers'].get('Last-Modified'))
+        return cached['body']
+
+    if 'no-store' not in response['headers'].get('Cache-Control', ''):
+        # A partial body is kept briefly and without validators, so a later
+        # 304 can never stand in for the full page
+        await run_blocking(page_cache.put, url, response['text'],
+                           response['headers'].get('ETag'), response['headers'].get('Last-Modified'),
+                           complete=response['stopped'] is None)
+    return response['text']
+
+async def analyze_website(url: str, include_links: bool = False, limiter=None) -> dict:
     """
-    Analyze a website and extract key information.
+    Analyze a website and extract key information. With include_links the
+    page's links are returned too, for the site crawler, which also passes
+    its per-domain limiter (see fetch_cached_page).
     """
     try:
         # Validate URL
         if not url.startswith(('http://', 'https://')):
             url = 'https://' + url
         
-        print(f"Fetching URL: {url}")  # Debug log
-        
-        # Simple GET request with increased timeout
-        response = requests.get(
-            url,
-            headers={'User-Agent': 'Mozilla/5.0'},
-            timeout=60,  # Increased timeout
-            verify=False  # Skip SSL verification
-        )
-        response.raise_for_status()
-        
-        # Basic HTML parsing
-        soup = BeautifulSoup(response.text, 'html.parser')
-        print("Successfully parsed HTML")  # Debug log
+        # The crawler needs the footer links too, so it reads the whole page
+        html = await fetch_cached_page(url, early_stop=not include_links, limiter=limiter)
         
-        # Initialize variables
-        title = "No title found"
-        description = "No description found"
-        content = "Could not extract content"
-        
-        # Extract title
-        try:
-            if soup.title and soup.title.string:
-                title = soup.title.string.strip()
-        except Exception as e:
-            print(f"Error extracting title: {e}")
-        
-        # Extract description
-        try:
-            meta_desc = soup.find('meta', {'name': ['description', 'Description']})
-            if meta_desc and meta_desc.get('content'):
-                description = meta_desc['content'].strip()
-        except Exception as e:
-            print(f"Error extracting description: {e}")
-        
-        # Extract content
-        try:
-            paragraphs = []
-            for p in soup.find_all('p', limit=2):
-                if p.get_text():
-                    paragraphs.append(p.get_text().strip())
-            if paragraphs:
-                content = ' '.join(paragraphs)
-        except Exception as e:
-            print(f"Error extracting content: {e}")
+        # Parsing is CPU-bound; keep it off the event loop
+        fields = await run_blocking(_extract_page_fields, html, include_links)
         
         return {
             'url': url,
             'domain': urlparse(url).netloc,
-            'title': title,
-            'description': description,
-            'content_preview': content[:300] + '...' if len(content) > 300 else content,
+            **fields,
             'status': 'success'
         }
         
-    except requests.Timeout:
+    except httpx.TimeoutException:
         print(f"Timeout error for URL: {url}")  # Debug log
         return {
             'url': url,
             'status': 'error',
             'error': 'الموقع يستغرق وقتاً طويلاً للرد. يرجى المحاولة مرة أخرى.'
         }
-    except requests.RequestException as e:
+    except FetchError as e:
+        print(f"Fetch refused for URL {url}: {str(e)}")  # Debug log
+        return {
+            'url': url,
+            'status': 'error',
+            'error': str(e)
+        }
+    except httpx.HTTPError as e:
         print(f"Request error for URL {url}: {str(e)}")  # Debug log
         return {
             'url': url,
@@ -109,20 +154,46 @@ def analyze_website(url: str) -> dict:
             'error': f'خطأ في تحليل الموقع: {str(e)}'
         }
 
-def generate_analysis_report(website_data: dict, user_profile: dict = None) -> str:
+async def generate_analysis_report(website_data: dict, user_profile: dict = None) -> str:
     """
     Generate a smart analysis report using GPT with user profile context.
+    Failures come back as an apology for the user instead of a report.
     """
     if website_data['status'] == 'error':
         return f"عذراً، لم أتمكن من تحليل الموقع {website_data['url']}. الخطأ: {website_data['error']}"
-    
+    try:
+        return await build_analysis_report(website_data, user_profile)
+    except LLMError as e:
+        return e.user_message
+    except Overloaded:
+        raise  # answered with 429 so the client retries
+    except Exception as e:
+        return f"عذراً، حدث خطأ في تحليل الموقع: {str(e)}"
+
+async def build_analysis_report(website_data: dict, user_profile: dict = None) -> str:
+    """
+    The analysis report for successfully fetched website data. Unlike
+    generate_analysis_report, raises LLMError when the model call fails, so
+    callers can tell a report from an apology.
+    """
     # Prepare context for GPT
     context = f"""
     تحليل موقع: {website_data['domain']}
     العنوان: {website_data['title']}
     الوصف: {website_data['description']}
+    الكلمات المفتاحية: {'، '.join(website_data.get('keywords') or [])}
     محتوى أولي: {website_data['content_preview']}
     """
+    if website_data.get('headings'):
+        context += f"    العناوين: {' | '.join(website_data['headings'][:MAX_REPORT_HEADINGS])}\n"
+    organization = website_data.get('organization') or {}
+    if organization:
+        details = '، '.join(str(organization[field]) for field in ('name', 'type', 'address', 'telephone')
+                           if organization.get(field))
+        context += f"    بيانات المنشأة: {details}\n"
+    # Inner pages picked by the site crawler (about, services, pricing, contact)
+    for page in website_data.get('pages') or []:
+        context += f"    صفحة {PAGE_LABELS.get(page['category'], page['category'])} ({page['url']}): {page['title']} - {page['content_preview']}\n"
     
     # Add user profile context if available
     profile_context = ""
@@ -135,30 +206,32 @@ def generate_analysis_report(website_data: dict, user_profile: dict = None) -> s
     """
     
     # Generate analysis using GPT
-    client = get_client()
+    system_prompt = """أنت مورفو، مساعد تسويقي ذكي. قم بتحليل الموقع المقدم وقدم تقريراً شاملاً باللغة العربية يتضمن:
+    1. تقييم عام للموقع
+    2. نقاط القوة والضعف
+    3. اقتراحات للتحسين
+    4. توصيات تسويقية مخصصة
+    5. استخراج معلومات عن نوع العمل والصناعة من الموقع
+    اجعل التقرير مفيداً ومهنياً ومخصصاً للمستخدم."""
     
-    try:
-        system_prompt = """أنت مورفو، مساعد تسويقي ذكي. قم بتحليل الموقع المقدم وقدم تقريراً شاملاً باللغة العربية يتضمن:
-        1. تقييم عام للموقع
-        2. نقاط القوة والضعف
-        3. اقتراحات للتحسين
-        4. توصيات تسويقية مخصصة
-        5. استخراج معلومات عن نوع العمل والصناعة من الموقع
-        اجعل التقرير مفيداً ومهنياً ومخصصاً للمستخدم."""
-        
-        if user_profile:
-            system_prompt += f"\n\nاستخدم معلومات المستخدم التالية لتخصيص التوصيات:\n{profile_context}"
-        
-        response = client.chat.completions.create(
-            model="gpt-4",
+    if user_profile:
+        system_prompt += f"\n\nاستخدم معلومات المستخدم التالية لتخصيص التوصيات:\n{profile_context}"
+    
+    async def generate() -> str:
+        # Reports get the heavy tier; chat keeps the faster ones
+        decision = route('analysis')
+        started = time.perf_counter()
+        response = await chat_completion(
+            model=decision['model'],
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": f"يرجى تحليل هذا الموقع:\n{context}"},
             ],
             temperature=0.7,
         )
-
+        record_latency(decision, time.perf_counter() - started)
         return response.choices[0].message.content.strip()
-        
-    except Exception as e:
-        return f"عذراً، حدث خطأ في تحليل الموقع: {str(e)}"
\ No newline at end of file
+
+    # Same page content and profile as before: reuse (or wait for) that report
+    key = report_key(website_data, user_profile)
+    return await report_cache.get_or_generate(key, website_data['domain'], generate)